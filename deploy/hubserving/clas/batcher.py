@@ -0,0 +1,147 @@
+# Copyright (c) 2020 PaddlePaddle Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+import time
+from concurrent.futures import Future
+from queue import Queue, Empty
+
+import numpy as np
+
+
+class _Request(object):
+    def __init__(self, inputs):
+        self.inputs = inputs
+        self.future = Future()
+
+
+class DynamicBatcher(object):
+    """
+    Coalesce the inputs of concurrent requests into batches. A batch is run
+    once it holds max_batch_size images, or max_wait_ms after its first
+    request arrived, and the outputs are scattered back to the requests.
+    A request larger than max_batch_size is run as a batch of its own.
+    Batches are formed one at a time and run by num_threads threads.
+
+    Args:
+        predict_fn(callable): maps a (N, C, H, W) batch to (N, ...) outputs,
+            such as Predictor.predict; it is called from num_threads
+            threads at the same time, e.g. PredictorPool.predict
+        max_batch_size(int): max number of images of every batch
+        max_wait_ms(float): max time a request waits for others to join
+        num_threads(int): number of batches run at the same time
+    """
+
+    def __init__(self,
+                 predict_fn,
+                 max_batch_size=16,
+                 max_wait_ms=5,
+                 num_threads=1):
+        self.predict_fn = predict_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue = Queue()
+        self._pending = None
+        self._lock = threading.Lock()
+        self._threads = []
+        for _ in range(max(num_threads, 1)):
+            thread = threading.Thread(target=self._loop)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, inputs):
+        """
+        Args:
+            inputs(np.ndarray): (N, C, H, W) batch of one request
+
+        Returns:
+            Future whose result is the (N, ...) outputs of inputs
+        """
+        request = _Request(inputs)
+        self._queue.put(request)
+        return request.future
+
+    def predict(self, inputs, timeout=None):
+        return self.submit(inputs).result(timeout)
+
+    def _next_batch(self):
+        """
+        Returns:
+            list of requests, None if the batcher is closed
+        """
+        first = self._pending
+        self._pending = None
+        if first is None:
+            first = self._queue.get()
+        if first is None:
+            # let the other threads stop too
+            self._queue.put(None)
+            return None
+        batch = [first]
+        num = len(first.inputs)
+        deadline = time.time() + self.max_wait
+        while num < self.max_batch_size:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            try:
+                request = self._queue.get(timeout=remaining)
+            except Empty:
+                break
+            if request is None:
+                # stop after this batch
+                self._queue.put(None)
+                break
+            if num + len(request.inputs) > self.max_batch_size:
+                # run it first in the next batch
+                self._pending = request
+                break
+            batch.append(request)
+            num += len(request.inputs)
+        return batch
+
+    def _run(self, batch):
+        batch = [r for r in batch if r.future.set_running_or_notify_cancel()]
+        if len(batch) == 0:
+            return
+        try:
+            if len(batch) == 1:
+                inputs = batch[0].inputs
+            else:
+                inputs = np.concatenate([r.inputs for r in batch])
+            outputs = self.predict_fn(inputs)
+        except Exception as e:
+            for request in batch:
+                request.future.set_exception(e)
+            return
+        start = 0
+        for request in batch:
+            end = start + len(request.inputs)
+            request.future.set_result(outputs[start:end])
+            start = end
+
+    def _loop(self):
+        while True:
+            with self._lock:
+                batch = self._next_batch()
+            if batch is None:
+                break
+            self._run(batch)
+
+    def close(self):
+        """ stop the batching threads after the queued requests are run """
+        self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
@@ -17,6 +17,7 @@ import sys
 sys.path.insert(0, ".")
 
 import time
+from concurrent.futures import Future, ThreadPoolExecutor
 
 from paddlehub.utils.log import logger
 from paddlehub.module.module import moduleinfo, serving
@@ -24,9 +25,11 @@ import cv2
 import numpy as np
 import paddle.nn as nn
 
-from tools.infer.predict import Predictor
-from tools.infer.utils import b64_to_np, postprocess
+from tools.infer.predict import PredictorPool
+from tools.infer.utils import b64_to_np, b64_to_frames, postprocess
+from tools.infer.utils import create_preprocessor, preprocess_frame
 from deploy.hubserving.clas.params import read_params
+from deploy.hubserving.clas.batcher import DynamicBatcher
 
 
 @moduleinfo(
@@ -62,7 +65,25 @@ class ClasSystem(nn.Layer):
         else:
             print("Use CPU")
             print("Enable MKL-DNN") if enable_mkldnn else None
-        self.predictor = Predictor(self.args)
+        self.predictor = PredictorPool(self.args, cfg.num_predictors,
+                                       cfg.dispatch)
+        self.preprocessor = create_preprocessor(self.args)
+        self.preprocess_pool = ThreadPoolExecutor(
+            max_workers=max(cfg.preprocess_workers, 1))
+        self.batcher = None
+        if cfg.max_batch_size > 1:
+            self.batcher = DynamicBatcher(
+                self.predictor.predict,
+                max_batch_size=cfg.max_batch_size,
+                max_wait_ms=cfg.max_wait_ms,
+                num_threads=cfg.num_predictors)
+
+    def _predict_async(self, batch_input):
+        if self.batcher is not None:
+            return self.batcher.submit(batch_input)
+        future = Future()
+        future.set_result(self.predictor.predict(batch_input))
+        return future
 
     def predict(self, batch_input_data, top_k=1):
         assert isinstance(
@@ -70,16 +91,62 @@ class ClasSystem(nn.Layer):
             np.ndarray), "The input data is inconsistent with expectations."
 
         starttime = time.time()
-        batch_outputs = self.predictor.predict(batch_input_data)
+        batch_outputs = self._predict_async(batch_input_data).result()
+        elapse = time.time() - starttime
+        batch_result_list = postprocess(batch_outputs, top_k)
+        return {"prediction": batch_result_list, "elapse": elapse}
+
+    def preprocess_frames(self, frames):
+        """
+        decode and preprocess frames into a batch with the preprocess pool
+        """
+        batch_input = self.preprocessor.alloc_batch(len(frames))
+        list(
+            self.preprocess_pool.map(preprocess_frame, frames, [
+                self.preprocessor
+            ] * len(frames), batch_input))
+        return batch_input
+
+    def predict_frames(self, frames, top_k=1):
+        """
+        predict encoded or uint8 frames, which are preprocessed in chunks of
+        max_batch_size, the next chunk is preprocessed while the batcher runs
+        the previous one. Without the batcher the frames are preprocessed
+        and predicted as one batch
+        """
+        starttime = time.time()
+        if len(frames) == 0:
+            return {"prediction": [], "elapse": time.time() - starttime}
+        if self.batcher is not None:
+            chunk_size = self.args.max_batch_size
+        else:
+            chunk_size = len(frames)
+        futures = []
+        for start in range(0, len(frames), chunk_size):
+            batch_input = self.preprocess_frames(frames[start:start +
+                                                        chunk_size])
+            futures.append(self._predict_async(batch_input))
+        batch_outputs = np.concatenate([f.result() for f in futures])
         elapse = time.time() - starttime
         batch_result_list = postprocess(batch_outputs, top_k)
         return {"prediction": batch_result_list, "elapse": elapse}
 
     @serving
-    def serving_method(self, images, revert_params, **kwargs):
+    def serving_method(self,
+                       images,
+                       revert_params=None,
+                       input_format="tensor",
+                       **kwargs):
         """
         Run as a service.
+        Args:
+            images(str): base64 string of the input
+            revert_params(dict): shape and dtype of the tensor input
+            input_format(str): "tensor" for a preprocessed float32 batch,
+                "frames" for images packed by tools.infer.utils.pack_frames
         """
+        if input_format == "frames":
+            return self.predict_frames(b64_to_frames(images), **kwargs)
         input_data = b64_to_np(images, revert_params)
         results = self.predict(batch_input_data=input_data, **kwargs)
         return results
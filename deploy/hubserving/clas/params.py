@@ -35,10 +35,21 @@ def read_params():
     cfg.use_tensorrt = False
     cfg.cpu_num_threads = 10
     cfg.enable_profile = False
+    # number of predictors sharing the weights, each one uses cpu_num_threads
+    # threads, see tools/infer/predict.py --enable_pool_benchmark
+    cfg.num_predictors = 1
+    cfg.dispatch = "least_loaded"
+
+    # params for dynamic batching, concurrent requests are run in batches of
+    # at most max_batch_size images, disabled if max_batch_size <= 1
+    cfg.max_batch_size = 16
+    cfg.max_wait_ms = 5
 
     # params for preprocess
     cfg.resize_short = 256
     cfg.resize = 224
     cfg.normalize = True
+    # number of threads that decode and preprocess the frames of requests
+    cfg.preprocess_workers = 4
 
     return cfg
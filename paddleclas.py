@@ -32,13 +32,17 @@ __dir__ = os.path.dirname(__file__)
 sys.path.append(os.path.join(__dir__, ''))
 import argparse
 import shutil
+import threading
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
+from queue import Queue, Empty, Full
 
 import cv2
 import numpy as np
 import tarfile
 import requests
 from tqdm import tqdm
-from tools.infer.utils import get_image_list, preprocess, save_prelabel_results
+from tools.infer.utils import iter_image_list, create_preprocessor, batch_topk, save_prelabel_results, create_sink, imread
 from tools.infer.predict import Predictor
 
 __all__ = ['PaddleClas']
@@ -176,6 +180,8 @@ def parse_args(mMain=True, add_help=True):
         parser.add_argument("--resize", type=int, default=224)
         parser.add_argument("--normalize", type=str2bool, default=True)
         parser.add_argument("-b", "--batch_size", type=int, default=1)
+        parser.add_argument("--num_workers", type=int, default=0)
+        parser.add_argument("--prefetch_batches", type=int, default=2)
 
         # params for predict
         parser.add_argument(
@@ -190,6 +196,12 @@ def parse_args(mMain=True, add_help=True):
         parser.add_argument("--top_k", type=int, default=1)
         parser.add_argument("--enable_mkldnn", type=str2bool, default=False)
         parser.add_argument("--cpu_num_threads", type=int, default=10)
+        parser.add_argument(
+            "--enable_stage_timer",
+            type=str2bool,
+            default=False,
+            help="Record the time of every inference stage as histograms")
+        parser.add_argument("--stage_timer_output", type=str, default=None)
 
         # parameters for pre-label the images
         parser.add_argument("--label_name_path", type=str, default='')
@@ -200,6 +212,14 @@ def parse_args(mMain=True, add_help=True):
             help="Whether to pre-label the images using the loaded weights")
         parser.add_argument("--pre_label_out_idr", type=str, default=None)
 
+        # params for saving the results
+        parser.add_argument(
+            "--output_file",
+            type=str,
+            default=None,
+            help="Save the results to a .jsonl or .npz file instead of keeping them in memory"
+        )
+
         return parser.parse_args()
     else:
         return argparse.Namespace(
@@ -213,6 +233,8 @@ def parse_args(mMain=True, add_help=True):
             resize=224,
             normalize=True,
             batch_size=1,
+            num_workers=0,
+            prefetch_batches=2,
             model_file='',
             params_file='',
             ir_optim=True,
@@ -221,9 +243,143 @@ def parse_args(mMain=True, add_help=True):
             top_k=1,
             enable_mkldnn=False,
             cpu_num_threads=10,
+            enable_stage_timer=False,
+            stage_timer_output=None,
             label_name_path='',
             pre_label_image=False,
-            pre_label_out_idr=None)
+            pre_label_out_idr=None,
+            output_file=None)
+
+
+class BatchPrefetcher(object):
+    """
+    Decode and preprocess images into batches in background threads, so
+    the predictor runs the current batch while the next ones are prepared.
+
+    Args:
+        image_list(iterable): image paths, consumed lazily
+        preprocessor(Preprocessor): created by create_preprocessor
+        batch_size(int): number of images of every batch
+        num_workers(int): number of decode/preprocess threads, batches are
+            prepared serially in the caller if num_workers <= 0
+        prefetch_batches(int): max number of ready batches kept in queue
+        timer(StageTimer): records read, decode, resize and normalize
+    """
+
+    def __init__(self,
+                 image_list,
+                 preprocessor,
+                 batch_size,
+                 num_workers=0,
+                 prefetch_batches=2,
+                 timer=None):
+        self.image_list = image_list
+        self.preprocessor = preprocessor
+        self.batch_size = batch_size
+        self.num_workers = num_workers
+        self.prefetch_batches = max(prefetch_batches, 1)
+        self.timer = timer if timer is not None and timer.enabled else None
+
+    def _load(self, img_path, out):
+        img = imread(img_path, self.timer)
+        if img is None:
+            print(
+                "Warning: Image file failed to read and has been skipped. The path: {}".
+                format(img_path))
+            return False
+        self.preprocessor(img, out=out, bgr=True, timer=self.timer)
+        return True
+
+    def _serial_batches(self):
+        batch_input = self.preprocessor.alloc_batch(self.batch_size)
+        img_path_list = []
+        for img_path in self.image_list:
+            if self._load(img_path, batch_input[len(img_path_list)]):
+                img_path_list.append(img_path)
+            if len(img_path_list) == self.batch_size:
+                yield img_path_list, batch_input
+                img_path_list = []
+        if len(img_path_list) > 0:
+            yield img_path_list, batch_input[:len(img_path_list)]
+
+    def _put(self, queue, item, stop):
+        while not stop.is_set():
+            try:
+                queue.put(item, timeout=0.1)
+                return True
+            except Full:
+                pass
+        return False
+
+    def _produce(self, pool, free_buffers, ready, stop):
+        try:
+            image_iter = iter(self.image_list)
+            while True:
+                chunk = list(islice(image_iter, self.batch_size))
+                if len(chunk) == 0:
+                    break
+                batch_input = None
+                while batch_input is None and not stop.is_set():
+                    try:
+                        batch_input = free_buffers.get(timeout=0.1)
+                    except Empty:
+                        pass
+                if batch_input is None:
+                    return
+                loaded = list(
+                    pool.map(self._load, chunk, batch_input[:len(chunk)]))
+                valid = [idx for idx, ok in enumerate(loaded) if ok]
+                if len(valid) == 0:
+                    free_buffers.put(batch_input)
+                    continue
+                if len(valid) < len(chunk):
+                    batch_input[:len(valid)] = batch_input[valid]
+                img_path_list = [chunk[idx] for idx in valid]
+                if not self._put(ready, (img_path_list, batch_input), stop):
+                    return
+            self._put(ready, None, stop)
+        except Exception as e:
+            self._put(ready, e, stop)
+
+    def _pipelined_batches(self):
+        # one buffer per queued batch, plus the ones being filled and used
+        free_buffers = Queue()
+        for _ in range(self.prefetch_batches + 2):
+            free_buffers.put(self.preprocessor.alloc_batch(self.batch_size))
+        ready = Queue(maxsize=self.prefetch_batches)
+        stop = threading.Event()
+        pool = ThreadPoolExecutor(max_workers=self.num_workers)
+        producer = threading.Thread(
+            target=self._produce, args=(pool, free_buffers, ready, stop))
+        producer.daemon = True
+        producer.start()
+        try:
+            while True:
+                item = ready.get()
+                if item is None:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                img_path_list, batch_input = item
+                yield img_path_list, batch_input[:len(img_path_list)]
+                # the consumer is done with the batch once it asks for the
+                # next one
+                free_buffers.put(batch_input)
+        finally:
+            stop.set()
+            producer.join()
+            pool.shutdown()
+
+    def __iter__(self):
+        """
+        Yields:
+            img_path_list(list): paths of the images in the batch
+            batch_input(np.ndarray): preprocessed batch, only valid until the
+                next batch is requested
+        """
+        if self.num_workers <= 0:
+            return self._serial_batches()
+        return self._pipelined_batches()
 
 
 class PaddleClas(object):
@@ -270,19 +426,82 @@ class PaddleClas(object):
 
         self.args = process_params
         self.predictor = Predictor(process_params)
+        self.timer = self.predictor.timer
 
     def postprocess(self, output):
-        output = output.flatten()
-        classes = np.argpartition(output, -self.args.top_k)[-self.args.top_k:]
-        class_ids = classes[np.argsort(-output[classes])]
-        scores = output[class_ids]
-        label_names = [self.label_name_dict[c]
-                       for c in class_ids] if self.label_name_dict else []
-        return {
-            "class_ids": class_ids,
-            "scores": scores,
-            "label_names": label_names
-        }
+        return self.batch_postprocess(output.reshape(1, -1))[0]
+
+    def batch_postprocess(self, batch_outputs):
+        class_ids, scores, _ = batch_topk(batch_outputs, self.args.top_k)
+        results = []
+        for ids, score in zip(class_ids, scores):
+            label_names = [self.label_name_dict[c] for c in ids
+                           ] if self.label_name_dict else []
+            results.append({
+                "class_ids": ids,
+                "scores": score,
+                "label_names": label_names
+            })
+        return results
+
+    def _predict_array(self, input_data):
+        if not self.args.is_preprocessed:
+            preprocessor = create_preprocessor(self.args)
+            batch_input = preprocessor.alloc_batch(1)
+            preprocessor(input_data, out=batch_input[0], bgr=True)
+            input_data = batch_input
+        else:
+            input_data = np.expand_dims(input_data, axis=0)
+        batch_outputs = self.predictor.predict(input_data)
+        result = {"filename": "image"}
+        result.update(self.postprocess(batch_outputs[0]))
+        return result
+
+    def _get_image_list(self, input_path):
+        # download internet image
+        if input_path.startswith('http'):
+            if not os.path.exists(BASE_IMAGES_DIR):
+                os.makedirs(BASE_IMAGES_DIR)
+            file_path = os.path.join(BASE_IMAGES_DIR, 'tmp.jpg')
+            download_with_progressbar(input_path, file_path)
+            print("Current using image from Internet:{}, renamed as: {}".
+                  format(input_path, file_path))
+            input_path = file_path
+        return iter_image_list(input_path)
+
+    def predict_iter(self, input_data):
+        """
+        predict label of images with paddleclas and yield the results one by
+        one. If args.num_workers > 0, images are decoded and preprocessed by
+        a pool of threads while the predictor runs the previous batch.
+        Args:
+            input_data(string, NumPy.ndarray): same as predict
+        Returns:
+            generator of dict: {image_name: "", class_id: [], scores: [], label_names: []}
+        """
+        if isinstance(input_data, np.ndarray):
+            yield self._predict_array(input_data)
+            return
+        image_list = self._get_image_list(input_data)
+        batches = BatchPrefetcher(
+            image_list,
+            create_preprocessor(self.args),
+            self.args.batch_size,
+            num_workers=self.args.num_workers,
+            prefetch_batches=self.args.prefetch_batches,
+            timer=self.timer)
+        for img_path_list, batch_input in batches:
+            batch_outputs = self.predictor.predict(batch_input)
+            with self.timer.stage("postprocess"):
+                batch_results = self.batch_postprocess(batch_outputs)
+            for number, postprocess_result in enumerate(batch_results):
+                result = {"filename": img_path_list[number]}
+                result.update(postprocess_result)
+                if self.args.pre_label_image:
+                    save_prelabel_results(result["class_ids"][0],
+                                          img_path_list[number],
+                                          self.args.pre_label_out_idr)
+                yield result
 
     def predict(self, input_data):
         """
@@ -295,64 +514,14 @@ class PaddleClas(object):
             dict: {image_name: "", class_id: [], scores: [], label_names: []}，if label name path == None，label_names will be empty.
         """
         if isinstance(input_data, np.ndarray):
-            if not self.args.is_preprocessed:
-                input_data = input_data[:, :, ::-1]
-                input_data = preprocess(input_data, self.args)
-            input_data = np.expand_dims(input_data, axis=0)
-            batch_outputs = self.predictor.predict(input_data)
-            result = {"filename": "image"}
-            result.update(self.postprocess(batch_outputs[0]))
-            return result
+            return self._predict_array(input_data)
         elif isinstance(input_data, str):
-            input_path = input_data
-            # download internet image
-            if input_path.startswith('http'):
-                if not os.path.exists(BASE_IMAGES_DIR):
-                    os.makedirs(BASE_IMAGES_DIR)
-                file_path = os.path.join(BASE_IMAGES_DIR, 'tmp.jpg')
-                download_with_progressbar(input_path, file_path)
-                print("Current using image from Internet:{}, renamed as: {}".
-                      format(input_path, file_path))
-                input_path = file_path
-            image_list = get_image_list(input_path)
-
             total_result = []
-            batch_input_list = []
-            img_path_list = []
-            cnt = 0
-            for idx, img_path in enumerate(image_list):
-                img = cv2.imread(img_path)
-                if img is None:
-                    print(
-                        "Warning: Image file failed to read and has been skipped. The path: {}".
-                        format(img_path))
-                    continue
-                else:
-                    img = img[:, :, ::-1]
-                    data = preprocess(img, self.args)
-                    batch_input_list.append(data)
-                    img_path_list.append(img_path)
-                    cnt += 1
-
-                if cnt % self.args.batch_size == 0 or (idx + 1
-                                                       ) == len(image_list):
-                    batch_outputs = self.predictor.predict(
-                        np.array(batch_input_list))
-                    for number, output in enumerate(batch_outputs):
-                        result = {"filename": img_path_list[number]}
-                        result.update(self.postprocess(output))
-
-                        result_str = "top-{} result: {}".format(
-                            self.args.top_k, result)
-                        print(result_str)
-
-                        total_result.append(result)
-                        if self.args.pre_label_image:
-                            save_prelabel_results(result["class_ids"][0],
-                                                  img_path_list[number],
-                                                  self.args.pre_label_out_idr)
-                    batch_input_list = []
-                    img_path_list = []
+            for result in self.predict_iter(input_data):
+                result_str = "top-{} result: {}".format(self.args.top_k,
+                                                        result)
+                print(result_str)
+                total_result.append(result)
             return total_result
         else:
             print(
@@ -366,7 +535,18 @@ def main():
     args = parse_args(mMain=True)
     clas_engine = PaddleClas(**(args.__dict__))
     print('{}{}{}'.format('*' * 10, args.image_file, '*' * 10))
-    total_result = clas_engine.predict(args.image_file)
+    sink = create_sink(args.output_file) if args.output_file else None
+    try:
+        # results are consumed one by one, memory does not grow with inputs
+        for result in clas_engine.predict_iter(args.image_file):
+            if sink is None:
+                print("top-{} result: {}".format(args.top_k, result))
+            else:
+                sink.write(result)
+    finally:
+        if sink is not None:
+            sink.close()
+    clas_engine.predictor.report_stages()
 
     print("Predict complete!")
 
@@ -0,0 +1,227 @@
+# copyright (c) 2020 PaddlePaddle Authors. All Rights Reserve.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib
+import os
+from collections import OrderedDict
+
+import numpy as np
+
+from .imaug import DecodeImage, ResizeImage, CropImage
+from .imaug import TransformPipeline
+from .imaug.transform_profiler import create_transform_profiler
+from ppcls.utils import logger
+
+# flags are stored in front of the images, aligned to a page
+_ALIGN = 4096
+
+
+def split_cacheable_ops(ops):
+    """
+    find the leading deterministic ops that produce a fixed shape uint8 image
+
+    Args:
+        ops(list): operators created by create_operators
+
+    Returns:
+        num(int): number of cacheable ops, 0 if nothing can be cached
+        shape(tuple): output shape of the cacheable ops
+    """
+    if len(ops) == 0 or not isinstance(ops[0], DecodeImage) or \
+            ops[0].channel_first:
+        return 0, None
+
+    num, shape = 0, None
+    for idx, op in enumerate(ops[1:], start=1):
+        if isinstance(op, CropImage):
+            w, h = op.size
+            shape = (h, w, 3)
+        elif isinstance(op, ResizeImage):
+            shape = None if op.resize_short is not None else (op.h, op.w, 3)
+        else:
+            break
+        if shape is not None:
+            num = idx + 1
+    return num, shape
+
+
+class ImageCache(object):
+    """
+    Cache the uint8 output of the deterministic prefix of the transforms in
+    a memory mapped file, so later epochs and eval runs skip decoding.
+
+    Args:
+        path(str): cache file path
+        num_samples(int): number of samples
+        shape(tuple): shape of every cached image
+    """
+
+    def __init__(self, path, num_samples, shape):
+        self.path = path
+        self.num_samples = num_samples
+        self.shape = tuple(shape)
+        self.data_start = (num_samples + _ALIGN - 1) // _ALIGN * _ALIGN
+        self.total_size = self.data_start + num_samples * int(
+            np.prod(self.shape))
+        self._flags = None
+        self._data = None
+        if not os.path.exists(path):
+            self._create()
+
+    def _create(self):
+        # create aside and rename, readers never see a partial file
+        tmp_path = "{}.{}.tmp".format(self.path, os.getpid())
+        mm = np.memmap(
+            tmp_path, dtype='uint8', mode='w+', shape=(self.total_size, ))
+        del mm
+        os.replace(tmp_path, self.path)
+
+    def _open(self):
+        mm = np.memmap(
+            self.path, dtype='uint8', mode='r+', shape=(self.total_size, ))
+        self._flags = mm[:self.num_samples]
+        self._data = mm[self.data_start:].reshape((self.num_samples, ) +
+                                                  self.shape)
+
+    def get(self, idx):
+        """
+        Returns:
+            a copy of the cached image, None if it is not cached yet
+        """
+        if self._data is None:
+            self._open()
+        if not self._flags[idx]:
+            return None
+        return np.array(self._data[idx])
+
+    def put(self, idx, img):
+        if self._data is None:
+            self._open()
+        if img.shape != self.shape or img.dtype != np.uint8:
+            return False
+        self._data[idx] = img
+        self._flags[idx] = 1
+        return True
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_flags'] = None
+        state['_data'] = None
+        return state
+
+
+class LRUCache(object):
+    """
+    In-memory LRU cache of ndarrays bounded by the total number of bytes.
+    Every dataloader worker holds its own cache.
+
+    Args:
+        max_bytes(int): byte budget of the cache
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._items = OrderedDict()
+
+    def get(self, key):
+        """
+        Returns:
+            a copy of the cached data, None if it is not cached
+        """
+        data = self._items.get(key)
+        if data is None:
+            return None
+        self._items.move_to_end(key)
+        return np.array(data)
+
+    def put(self, key, data):
+        data = np.array(data)
+        if data.nbytes > self.max_bytes:
+            return False
+        if key in self._items:
+            self.nbytes -= self._items.pop(key).nbytes
+        while self.nbytes + data.nbytes > self.max_bytes:
+            _, item = self._items.popitem(last=False)
+            self.nbytes -= item.nbytes
+        self._items[key] = data
+        self.nbytes += data.nbytes
+        return True
+
+    def __len__(self):
+        return len(self._items)
+
+
+def create_image_cache(params, full_lines, ops):
+    """
+    create the decoded image cache if it is enabled by cache_dir
+
+    Args:
+        params(dict): reader params
+        full_lines(list): lines of the file list, in sample order
+        ops(list): operators created from params['transforms']
+
+    Returns:
+        cache(ImageCache): None if cache is disabled or not applicable
+        num(int): number of ops whose output is cached
+    """
+    cache_dir = params.get('cache_dir')
+    if not cache_dir:
+        return None, 0
+
+    num, shape = split_cacheable_ops(ops)
+    if num == 0:
+        logger.warning(
+            "cache_dir is set but the transforms do not start with a "
+            "deterministic decode/resize/crop of fixed size, cache disabled")
+        return None, 0
+
+    md5 = hashlib.md5()
+    md5.update(repr(params['transforms'][:num]).encode('utf8'))
+    md5.update(params.get('data_dir', '').encode('utf8'))
+    md5.update("\n".join(full_lines).encode('utf8'))
+    os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.join(cache_dir, "{}.cache".format(md5.hexdigest()))
+    logger.info("cache the output of the first {} transforms in {}".format(
+        num, path))
+    return ImageCache(path, len(full_lines), shape), num
+
+
+def create_transform_pipeline(params, ops, full_lines=None):
+    """
+    create the transform pipeline of a dataset, the cache is chosen by params:
+        cache_dir: cache fixed shape uint8 images on disk, see ImageCache
+        cache_mem_size: cache the deterministic prefix of ops in memory,
+            the budget is in MB for every dataloader worker
+    and the ops are recorded by a TransformProfiler if profile_transforms
+    is set
+
+    Args:
+        params(dict): reader params
+        ops(list): operators created from params['transforms']
+        full_lines(list): lines of the file list, required by cache_dir
+    """
+    profiler = create_transform_profiler(params, ops)
+    if full_lines is not None:
+        cache, num = create_image_cache(params, full_lines, ops)
+        if cache is not None:
+            return TransformPipeline(ops, cache, num, profiler)
+
+    cache_mem_size = params.get('cache_mem_size')
+    if cache_mem_size:
+        return TransformPipeline(
+            ops,
+            LRUCache(cache_mem_size * 1024 * 1024),
+            profiler=profiler)
+    return TransformPipeline(ops, profiler=profiler)
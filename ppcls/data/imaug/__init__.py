@@ -25,6 +25,7 @@ from .operators import ResizeImage
 from .operators import CropImage
 from .operators import RandCropImage
 from .operators import RandFlipImage
+from .operators import RandResizedCropFlip
 from .operators import NormalizeImage
 from .operators import ToCHWImage
 
@@ -32,18 +33,17 @@ from .batch_operators import MixupOperator
 from .batch_operators import CutmixOperator
 from .batch_operators import FmixOperator
 
+from .pipeline import transform
+from .pipeline import TransformPipeline
+from .pipeline import split_operators
+from .pipeline import configure_reduced_decode
+from .transform_profiler import TransformProfiler
+
 import six
 import numpy as np
 from PIL import Image
 
 
-def transform(data, ops=[]):
-    """ transform """
-    for op in ops:
-        data = op(data)
-    return data
-
-
 class AutoAugment(RawImageNetPolicy):
     """ ImageNetPolicy wrapper to auto fit different img types """
 
@@ -54,7 +54,12 @@ class AutoAugment(RawImageNetPolicy):
             super().__init__(*args, **kwargs)
 
     def __call__(self, img):
-        if not isinstance(img, Image.Image):
+        if self.backend == "cv2":
+            # run on the ndarray, without the round trip through PIL
+            if isinstance(img, Image.Image):
+                img = np.asarray(img)
+            img = np.ascontiguousarray(img)
+        elif not isinstance(img, Image.Image):
             img = np.ascontiguousarray(img)
             img = Image.fromarray(img)
 
@@ -79,7 +84,12 @@ class RandAugment(RawRandAugment):
             super().__init__(*args, **kwargs)
 
     def __call__(self, img):
-        if not isinstance(img, Image.Image):
+        if self.backend == "cv2":
+            # run on the ndarray, without the round trip through PIL
+            if isinstance(img, Image.Image):
+                img = np.asarray(img)
+            img = np.ascontiguousarray(img)
+        elif not isinstance(img, Image.Image):
             img = np.ascontiguousarray(img)
             img = Image.fromarray(img)
 
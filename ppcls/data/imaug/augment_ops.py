@@ -0,0 +1,268 @@
+# Copyright (c) 2020 PaddlePaddle Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# The ops of the AutoAugment and RandAugment policies on uint8 HWC RGB
+# ndarrays with cv2 and lookup tables, following the PIL ops used by
+# autoaugment.py and randaugment.py
+
+import random
+
+import cv2
+import numpy as np
+
+_IDENTITY = np.arange(256, dtype='int64')
+
+# ImageFilter.SMOOTH
+_SMOOTH_KERNEL = np.array(
+    [[1, 1, 1], [1, 5, 1], [1, 1, 1]], dtype='float32') / 13.0
+
+
+# uint8 lookup tables of the pointwise ops by (op, magnitude), the
+# magnitudes come from fixed tables, so that every table is built once per
+# process, i.e. per reader worker
+_LUT_CACHE = {}
+
+
+def _to_lut(lut):
+    return np.clip(lut, 0, 255).astype('uint8')
+
+
+def cached_lut(key, build):
+    """
+    Args:
+        key(tuple): op name and the magnitude of the table
+        build(callable): returns the table as a (256, ) array
+    """
+    lut = _LUT_CACHE.get(key)
+    if lut is None:
+        lut = _to_lut(build())
+        _LUT_CACHE[key] = lut
+    return lut
+
+
+def posterize_lut(bits):
+    bits = int(bits)
+    return cached_lut(("posterize", bits),
+                      lambda: _IDENTITY & ~(2**(8 - bits) - 1))
+
+
+def solarize_lut(threshold):
+    return cached_lut(
+        ("solarize", threshold),
+        lambda: np.where(_IDENTITY < threshold, _IDENTITY, 255 - _IDENTITY))
+
+
+def blend_lut(degenerate, factor):
+    """
+    lut of Image.blend(degenerate, img, factor) for a constant degenerate,
+    in float32 and truncated as PIL
+    """
+
+    def build():
+        alpha = np.float32(factor)
+        diff = (_IDENTITY - degenerate).astype('float32')
+        return np.trunc(np.float32(degenerate) + alpha * diff)
+
+    return cached_lut(("blend", degenerate, factor), build)
+
+
+def invert_lut():
+    return cached_lut(("invert", ), lambda: 255 - _IDENTITY)
+
+
+def autocontrast_lut(lo, hi):
+    """ ImageOps.autocontrast of a channel from lo to hi """
+
+    def build():
+        if hi <= lo:
+            return _IDENTITY
+        scale = 255.0 / (hi - lo)
+        return (_IDENTITY * scale - lo * scale).astype('int64')
+
+    return cached_lut(("autocontrast", lo, hi), build)
+
+
+def _apply_lut(img, lut):
+    """
+    Args:
+        lut(np.ndarray): uint8, (256, ) applied to every channel, or
+            (256, C)
+    """
+    if lut.ndim == 2:
+        lut = np.ascontiguousarray(lut).reshape((256, 1, lut.shape[1]))
+    return cv2.LUT(img, lut)
+
+
+def _blend(degenerate, img, factor):
+    """ Image.blend(degenerate, img, factor) """
+    # addWeighted rounds, about -0.5 truncates as PIL does
+    return cv2.addWeighted(img, factor, degenerate, 1 - factor, -0.499)
+
+
+def _warp_affine(img, matrix, interpolation, fillcolor):
+    """
+    Image.transform(size, Image.AFFINE, matrix), the matrix maps the output
+    to the input coordinates with pixel centers at 0.5 like PIL
+    """
+    a, b, c, d, e, f = matrix
+    # move the pixel centers to the integer coordinates of cv2
+    c = c + 0.5 * (a + b - 1)
+    f = f + 0.5 * (d + e - 1)
+    h, w = img.shape[:2]
+    return cv2.warpAffine(
+        img,
+        np.array(
+            [[a, b, c], [d, e, f]], dtype='float64'), (w, h),
+        flags=interpolation | cv2.WARP_INVERSE_MAP,
+        borderMode=cv2.BORDER_CONSTANT,
+        borderValue=tuple(fillcolor))
+
+
+def shear_x(img, magnitude, fillcolor):
+    return _warp_affine(img, (1, magnitude * random.choice([-1, 1]), 0, 0, 1,
+                              0), cv2.INTER_CUBIC, fillcolor)
+
+
+def shear_y(img, magnitude, fillcolor):
+    return _warp_affine(img, (1, 0, 0, magnitude * random.choice([-1, 1]), 1,
+                              0), cv2.INTER_CUBIC, fillcolor)
+
+
+def translate_x(img, magnitude, fillcolor):
+    offset = magnitude * img.shape[1] * random.choice([-1, 1])
+    return _warp_affine(img, (1, 0, offset, 0, 1, 0), cv2.INTER_NEAREST,
+                        fillcolor)
+
+
+def translate_y(img, magnitude, fillcolor):
+    offset = magnitude * img.shape[0] * random.choice([-1, 1])
+    return _warp_affine(img, (1, 0, 0, 0, 1, offset), cv2.INTER_NEAREST,
+                        fillcolor)
+
+
+def rotate(img, magnitude, fillcolor):
+    """ counter clockwise around the center, filled with gray as
+    rotate_with_fill """
+    h, w = img.shape[:2]
+    matrix = cv2.getRotationMatrix2D(((w - 1) / 2.0, (h - 1) / 2.0),
+                                     magnitude, 1.0)
+    return cv2.warpAffine(
+        img,
+        matrix, (w, h),
+        flags=cv2.INTER_NEAREST,
+        borderMode=cv2.BORDER_CONSTANT,
+        borderValue=(128, 128, 128))
+
+
+def color(img, magnitude, fillcolor):
+    factor = 1 + magnitude * random.choice([-1, 1])
+    if img.ndim != 3:
+        return img
+    gray = cv2.cvtColor(img, cv2.COLOR_RGB2GRAY)
+    return _blend(cv2.cvtColor(gray, cv2.COLOR_GRAY2RGB), img, factor)
+
+
+def posterize(img, magnitude, fillcolor):
+    return _apply_lut(img, posterize_lut(magnitude))
+
+
+def solarize(img, magnitude, fillcolor):
+    return _apply_lut(img, solarize_lut(magnitude))
+
+
+def contrast(img, magnitude, fillcolor):
+    factor = 1 + magnitude * random.choice([-1, 1])
+    gray = cv2.cvtColor(img, cv2.COLOR_RGB2GRAY) if img.ndim == 3 else img
+    mean = int(gray.mean() + 0.5)
+    return _apply_lut(img, blend_lut(mean, factor))
+
+
+def sharpness(img, magnitude, fillcolor):
+    factor = 1 + magnitude * random.choice([-1, 1])
+    degenerate = cv2.filter2D(img, -1, _SMOOTH_KERNEL)
+    # PIL keeps the border pixels
+    degenerate[0, :] = img[0, :]
+    degenerate[-1, :] = img[-1, :]
+    degenerate[:, 0] = img[:, 0]
+    degenerate[:, -1] = img[:, -1]
+    return _blend(degenerate, img, factor)
+
+
+def brightness(img, magnitude, fillcolor):
+    factor = 1 + magnitude * random.choice([-1, 1])
+    return _apply_lut(img, blend_lut(0, factor))
+
+
+def _channels(img):
+    """ contiguous channels of img """
+    return cv2.split(img) if img.ndim == 3 else [img]
+
+
+def autocontrast(img, magnitude, fillcolor):
+    luts = [
+        autocontrast_lut(*cv2.minMaxLoc(channel)[:2])
+        for channel in _channels(img)
+    ]
+    if len(luts) == 1:
+        return _apply_lut(img, luts[0])
+    return _apply_lut(img, np.stack(luts, axis=1))
+
+
+def equalize(img, magnitude, fillcolor):
+    luts = []
+    for channel in _channels(img):
+        hist = np.bincount(channel.ravel(), minlength=256)
+        nonzero = hist[hist > 0]
+        step = (nonzero.sum() - nonzero[-1]) // 255 if len(nonzero) > 1 else 0
+        if step == 0:
+            luts.append(_IDENTITY)
+        else:
+            cum = np.concatenate([[0], np.cumsum(hist)[:-1]])
+            luts.append((step // 2 + cum) // step)
+    lut = _to_lut(np.stack(luts, axis=1))
+    return _apply_lut(img, lut if img.ndim == 3 else lut[:, 0])
+
+
+def invert(img, magnitude, fillcolor):
+    return _apply_lut(img, invert_lut())
+
+
+OPS = {
+    "shearX": shear_x,
+    "shearY": shear_y,
+    "translateX": translate_x,
+    "translateY": translate_y,
+    "rotate": rotate,
+    "color": color,
+    "posterize": posterize,
+    "solarize": solarize,
+    "contrast": contrast,
+    "sharpness": sharpness,
+    "brightness": brightness,
+    "autocontrast": autocontrast,
+    "equalize": equalize,
+    "invert": invert,
+}
+
+
+def create_ops(fillcolor=(128, 128, 128)):
+    """
+    Returns:
+        dict of op name to func(img, magnitude) on uint8 ndarrays, the same
+        interface as the PIL ops of SubPolicy and RandAugment
+    """
+    return {
+        name: (lambda img, magnitude, op=op: op(img, magnitude, fillcolor))
+        for name, op in OPS.items()
+    }
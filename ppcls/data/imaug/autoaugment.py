@@ -18,6 +18,8 @@ from PIL import Image, ImageEnhance, ImageOps
 import numpy as np
 import random
 
+from .augment_ops import create_ops
+
 
 class ImageNetPolicy(object):
     """ Randomly choose one of the best 24 Sub-policies on ImageNet.
@@ -33,7 +35,8 @@ class ImageNetPolicy(object):
         >>>     transforms.ToTensor()])
     """
 
-    def __init__(self, fillcolor=(128, 128, 128)):
+    def __init__(self, fillcolor=(128, 128, 128), backend="pil"):
+        self.backend = backend
         self.policies = [
             SubPolicy(0.4, "posterize", 8, 0.6, "rotate", 9, fillcolor),
             SubPolicy(0.6, "solarize", 5, 0.6, "autocontrast", 5, fillcolor),
@@ -61,6 +64,8 @@ class ImageNetPolicy(object):
             SubPolicy(0.6, "color", 4, 1.0, "contrast", 8, fillcolor),
             SubPolicy(0.8, "equalize", 8, 0.6, "equalize", 3, fillcolor)
         ]
+        if backend == "cv2":
+            use_cv2_ops(self.policies, fillcolor)
 
     def __call__(self, img, policy_idx=None):
         if policy_idx is None or not isinstance(policy_idx, int):
@@ -87,7 +92,8 @@ class CIFAR10Policy(object):
         >>>     transforms.ToTensor()])
     """
 
-    def __init__(self, fillcolor=(128, 128, 128)):
+    def __init__(self, fillcolor=(128, 128, 128), backend="pil"):
+        self.backend = backend
         self.policies = [
             SubPolicy(0.1, "invert", 7, 0.2, "contrast", 6, fillcolor),
             SubPolicy(0.7, "rotate", 2, 0.3, "translateX", 9, fillcolor),
@@ -115,6 +121,8 @@ class CIFAR10Policy(object):
             SubPolicy(0.8, "equalize", 8, 0.1, "invert", 3, fillcolor),
             SubPolicy(0.7, "translateY", 9, 0.9, "autocontrast", 1, fillcolor)
         ]
+        if backend == "cv2":
+            use_cv2_ops(self.policies, fillcolor)
 
     def __call__(self, img, policy_idx=None):
         if policy_idx is None or not isinstance(policy_idx, int):
@@ -141,7 +149,8 @@ class SVHNPolicy(object):
         >>>     transforms.ToTensor()])
     """
 
-    def __init__(self, fillcolor=(128, 128, 128)):
+    def __init__(self, fillcolor=(128, 128, 128), backend="pil"):
+        self.backend = backend
         self.policies = [
             SubPolicy(0.9, "shearX", 4, 0.2, "invert", 3, fillcolor),
             SubPolicy(0.9, "shearY", 8, 0.7, "invert", 5, fillcolor),
@@ -175,6 +184,8 @@ class SVHNPolicy(object):
                                                       fillcolor),
             SubPolicy(0.7, "shearX", 2, 0.1, "invert", 5, fillcolor)
         ]
+        if backend == "cv2":
+            use_cv2_ops(self.policies, fillcolor)
 
     def __call__(self, img, policy_idx=None):
         if policy_idx is None or not isinstance(policy_idx, int):
@@ -249,6 +260,8 @@ class SubPolicy(object):
             "invert": lambda img, magnitude: ImageOps.invert(img)
         }
 
+        self.name1 = operation1
+        self.name2 = operation2
         self.p1 = p1
         self.operation1 = func[operation1]
         self.magnitude1 = ranges[operation1][magnitude_idx1]
@@ -262,3 +275,11 @@ class SubPolicy(object):
         if random.random() < self.p2:
             img = self.operation2(img, self.magnitude2)
         return img
+
+
+def use_cv2_ops(policies, fillcolor=(128, 128, 128)):
+    """ rebind the ops of the sub policies to the same ops on uint8 ndarrays """
+    func = create_ops(fillcolor)
+    for policy in policies:
+        policy.operation1 = func[policy.name1]
+        policy.operation2 = func[policy.name2]
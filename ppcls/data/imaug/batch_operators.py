@@ -23,24 +23,40 @@ from .fmix import sample_mask
 
 
 class BatchOperator(object):
-    """ BatchOperator """
+    """
+    BatchOperator, called with a stacked batch (imgs, labels) and returns
+    (imgs, labels, mixed labels, lams). The images are mixed in place.
+    """
 
     def __init__(self, *args, **kwargs):
         pass
 
     def _unpack(self, batch):
         """ _unpack """
-        assert isinstance(batch, list), \
-                'batch should be a list filled with tuples (img, label)'
-        bs = len(batch)
+        if isinstance(batch, list):
+            # list filled with tuples (img, label)
+            bs = len(batch)
+            assert bs > 0, 'size of the batch data should > 0'
+            imgs, labels = list(zip(*batch))
+            return np.stack(imgs), np.array(labels), bs
+        imgs, labels = batch
+        bs = len(imgs)
         assert bs > 0, 'size of the batch data should > 0'
-        imgs, labels = list(zip(*batch))
-        return np.array(imgs), np.array(labels), bs
+        return imgs, labels, bs
 
     def __call__(self, batch):
         return batch
 
 
+def _blend(imgs, idx, weight):
+    """ imgs = weight * imgs + (1 - weight) * imgs[idx], in place """
+    shuffled = imgs[idx]
+    np.subtract(imgs, shuffled, out=imgs)
+    np.multiply(imgs, weight, out=imgs)
+    np.add(imgs, shuffled, out=imgs)
+    return imgs
+
+
 class MixupOperator(BatchOperator):
     """ Mixup operator """
 
@@ -53,9 +69,9 @@ class MixupOperator(BatchOperator):
         imgs, labels, bs = self._unpack(batch)
         idx = np.random.permutation(bs)
         lam = np.random.beta(self._alpha, self._alpha)
-        lams = np.array([lam] * bs, dtype=np.float32)
-        imgs = lam * imgs + (1 - lam) * imgs[idx]
-        return list(zip(imgs, labels, labels[idx], lams))
+        lams = np.full(bs, lam, dtype=np.float32)
+        imgs = _blend(imgs, idx, imgs.dtype.type(lam))
+        return imgs, labels, labels[idx], lams
 
 
 class CutmixOperator(BatchOperator):
@@ -71,8 +87,8 @@ class CutmixOperator(BatchOperator):
         w = size[2]
         h = size[3]
         cut_rat = np.sqrt(1. - lam)
-        cut_w = np.int(w * cut_rat)
-        cut_h = np.int(h * cut_rat)
+        cut_w = int(w * cut_rat)
+        cut_h = int(h * cut_rat)
 
         # uniform
         cx = np.random.randint(w)
@@ -91,11 +107,12 @@ class CutmixOperator(BatchOperator):
         lam = np.random.beta(self._alpha, self._alpha)
 
         bbx1, bby1, bbx2, bby2 = self._rand_bbox(imgs.shape, lam)
+        # only the box is copied
         imgs[:, :, bbx1:bbx2, bby1:bby2] = imgs[idx, :, bbx1:bbx2, bby1:bby2]
         lam = 1 - (float(bbx2 - bbx1) * (bby2 - bby1) /
                    (imgs.shape[-2] * imgs.shape[-1]))
-        lams = np.array([lam] * bs, dtype=np.float32)
-        return list(zip(imgs, labels, labels[idx], lams))
+        lams = np.full(bs, lam, dtype=np.float32)
+        return imgs, labels, labels[idx], lams
 
 
 class FmixOperator(BatchOperator):
@@ -113,5 +130,6 @@ class FmixOperator(BatchOperator):
         size = (imgs.shape[2], imgs.shape[3])
         lam, mask = sample_mask(self._alpha, self._decay_power, \
                 size, self._max_soft, self._reformulate)
-        imgs = mask * imgs + (1 - mask) * imgs[idx]
-        return list(zip(imgs, labels, labels[idx], [lam] * bs))
+        imgs = _blend(imgs, idx, mask.astype(imgs.dtype))
+        lams = np.full(bs, lam, dtype=np.float32)
+        return imgs, labels, labels[idx], lams
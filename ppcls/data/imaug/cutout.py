@@ -26,16 +26,14 @@ class Cutout(object):
     def __call__(self, img):
         """ cutout_image """
         h, w = img.shape[:2]
-        mask = np.ones((h, w), np.float32)
-
-        for n in range(self.n_holes):
-            y = np.random.randint(h)
-            x = np.random.randint(w)
-
-            y1 = np.clip(y - self.length // 2, 0, h)
-            y2 = np.clip(y + self.length // 2, 0, h)
-            x1 = np.clip(x - self.length // 2, 0, w)
-            x2 = np.clip(x + self.length // 2, 0, w)
-
+        # sample the centers of all the holes at once
+        ys = np.random.randint(h, size=self.n_holes)
+        xs = np.random.randint(w, size=self.n_holes)
+        y1s = np.clip(ys - self.length // 2, 0, h)
+        y2s = np.clip(ys + self.length // 2, 0, h)
+        x1s = np.clip(xs - self.length // 2, 0, w)
+        x2s = np.clip(xs + self.length // 2, 0, w)
+
+        for y1, y2, x1, x2 in zip(y1s, y2s, x1s, x2s):
             img[y1:y2, x1:x2] = 0
         return img
@@ -0,0 +1,268 @@
+# Copyright (c) 2020 PaddlePaddle Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import numpy as np
+import paddle
+
+from .fmix import sample_mask
+
+__all__ = [
+    'DeviceMixupOperator', 'DeviceCutmixOperator', 'DeviceFmixOperator',
+    'create_device_operators', 'DeviceNormalize', 'split_normalize',
+    'create_device_normalize'
+]
+
+
+class DeviceBatchOperator(object):
+    """
+    Batch operator run on the feeds of a step with paddle ops, i.e. on the
+    place of the model. Called with the feeds {"image", "label"} and
+    returns the mix feeds {"image", "y_a", "y_b", "lam"}. Only the random
+    numbers and the masks are drawn on host, in the order of the batch
+    operators, so that they mix alike with the same numpy seed.
+    """
+
+    def _permutation(self, feeds):
+        return np.random.permutation(feeds["image"].shape[0])
+
+    def _mix(self, feeds, idx, weight, lam):
+        """
+        image = weight * image + (1 - weight) * image[idx]
+
+        Args:
+            feeds(dict): image and label tensors of the batch
+            idx(np.ndarray): permutation of the batch
+            weight(float|np.ndarray): blending weight of the image, or a
+                (1, 1, H, W) mask
+            lam(float): share of the label of the image
+        """
+        image = feeds["image"]
+        label = feeds["label"]
+        bs = image.shape[0]
+        idx = paddle.to_tensor(idx.astype('int64'))
+        shuffled = paddle.gather(image, idx)
+        if isinstance(weight, np.ndarray):
+            weights = [
+                paddle.cast(paddle.to_tensor(w.astype('float32')), image.dtype)
+                for w in (weight, 1 - weight)
+            ]
+        else:
+            weights = [weight, 1 - weight]
+        image = image * weights[0] + shuffled * weights[1]
+        return {
+            "image": image,
+            "y_a": label,
+            "y_b": paddle.gather(label, idx),
+            "lam": paddle.full([bs, 1], lam, dtype='float32'),
+        }
+
+    def __call__(self, feeds):
+        return feeds
+
+
+class DeviceMixupOperator(DeviceBatchOperator):
+    """ Mixup operator """
+
+    def __init__(self, alpha=0.2):
+        assert alpha > 0., \
+                'parameter alpha[%f] should > 0.0' % (alpha)
+        self._alpha = alpha
+
+    def __call__(self, feeds):
+        idx = self._permutation(feeds)
+        lam = float(np.random.beta(self._alpha, self._alpha))
+        return self._mix(feeds, idx, lam, lam)
+
+
+class DeviceCutmixOperator(DeviceBatchOperator):
+    """ Cutmix operator """
+
+    def __init__(self, alpha=0.2):
+        assert alpha > 0., \
+                'parameter alpha[%f] should > 0.0' % (alpha)
+        self._alpha = alpha
+
+    def _rand_bbox(self, size, lam):
+        """ _rand_bbox """
+        w = size[2]
+        h = size[3]
+        cut_rat = np.sqrt(1. - lam)
+        cut_w = int(w * cut_rat)
+        cut_h = int(h * cut_rat)
+
+        # uniform
+        cx = np.random.randint(w)
+        cy = np.random.randint(h)
+
+        bbx1 = np.clip(cx - cut_w // 2, 0, w)
+        bby1 = np.clip(cy - cut_h // 2, 0, h)
+        bbx2 = np.clip(cx + cut_w // 2, 0, w)
+        bby2 = np.clip(cy + cut_h // 2, 0, h)
+
+        return bbx1, bby1, bbx2, bby2
+
+    def __call__(self, feeds):
+        shape = feeds["image"].shape
+        idx = self._permutation(feeds)
+        lam = np.random.beta(self._alpha, self._alpha)
+        bbx1, bby1, bbx2, bby2 = self._rand_bbox(shape, lam)
+        # keep the image outside of the box
+        mask = np.ones((1, 1, shape[2], shape[3]), dtype='float32')
+        mask[:, :, bbx1:bbx2, bby1:bby2] = 0
+        lam = 1 - (float(bbx2 - bbx1) * (bby2 - bby1) /
+                   (shape[2] * shape[3]))
+        return self._mix(feeds, idx, mask, lam)
+
+
+class DeviceFmixOperator(DeviceBatchOperator):
+    """ Fmix operator """
+
+    def __init__(self, alpha=1, decay_power=3, max_soft=0., reformulate=False):
+        self._alpha = alpha
+        self._decay_power = decay_power
+        self._max_soft = max_soft
+        self._reformulate = reformulate
+
+    def __call__(self, feeds):
+        shape = feeds["image"].shape
+        idx = self._permutation(feeds)
+        lam, mask = sample_mask(self._alpha, self._decay_power, \
+                (shape[2], shape[3]), self._max_soft, self._reformulate)
+        return self._mix(feeds, idx, mask, lam)
+
+
+DEVICE_OPERATORS = {
+    "MixupOperator": DeviceMixupOperator,
+    "CutmixOperator": DeviceCutmixOperator,
+    "FmixOperator": DeviceFmixOperator,
+}
+
+
+def create_device_operators(params):
+    """
+    create the device operators of the batch operators in the config
+
+    Args:
+        params(list): a dict list, such as the mix of TRAIN
+    """
+    assert isinstance(params, list), ('operator config should be a list')
+    ops = []
+    for operator in params:
+        assert isinstance(operator,
+                          dict) and len(operator) == 1, "yaml format error"
+        op_name = list(operator)[0]
+        assert op_name in DEVICE_OPERATORS, \
+                '{} can not be run on device'.format(op_name)
+        param = {} if operator[op_name] is None else operator[op_name]
+        ops.append(DEVICE_OPERATORS[op_name](**param))
+    return ops
+
+
+class DeviceNormalize(object):
+    """
+    NormalizeImage of a uint8 NCHW batch with paddle ops, so that the
+    reader ships uint8 images. Takes the params of NormalizeImage, the
+    scale is folded into the std so that the batch is normalized by one
+    cast and one multiply-add.
+    """
+
+    def __init__(self,
+                 scale=None,
+                 mean=None,
+                 std=None,
+                 order='chw',
+                 output_fp16=False,
+                 channel_num=3):
+        if isinstance(scale, str):
+            scale = eval(scale)
+        assert channel_num in [3, 4], \
+                "channel number of input image should be set to 3 or 4."
+        self.channel_num = channel_num
+        self.output_dtype = 'float16' if output_fp16 else 'float32'
+        scale = np.float32(scale if scale is not None else 1.0 / 255.0)
+        mean = mean if mean is not None else [0.485, 0.456, 0.406]
+        std = std if std is not None else [0.229, 0.224, 0.225]
+        # (x * scale - mean) / std = x * weight + bias, the batch is NCHW
+        # whatever the order of NormalizeImage
+        mean = np.array(mean, dtype='float32').reshape((1, 3, 1, 1))
+        std = np.array(std, dtype='float32').reshape((1, 3, 1, 1))
+        self._np_weight = scale / std
+        self._np_bias = -mean / std
+        # created at the first call, on the place of the batch
+        self.weight = None
+        self.bias = None
+
+    def __call__(self, image):
+        if self.weight is None:
+            self.weight = paddle.to_tensor(self._np_weight)
+            self.bias = paddle.to_tensor(self._np_bias)
+        image = paddle.cast(image, 'float32') * self.weight + self.bias
+        if self.channel_num == 4:
+            shape = image.shape
+            pad_zeros = paddle.zeros(
+                [shape[0], 1, shape[2], shape[3]], dtype='float32')
+            image = paddle.concat([image, pad_zeros], axis=1)
+        if self.output_dtype != 'float32':
+            image = paddle.cast(image, self.output_dtype)
+        image.stop_gradient = True
+        return image
+
+
+def split_normalize(transforms):
+    """
+    remove NormalizeImage from the transforms config
+
+    Args:
+        transforms(list): a dict list, such as the transforms of TRAIN
+
+    Returns:
+        the transforms without NormalizeImage and the params of it, or
+        (transforms, None) if NormalizeImage is not followed by ToCHWImage
+        only, e.g. RandomErasing expects normalized images
+    """
+    names = [list(operator)[0] for operator in transforms]
+    if 'NormalizeImage' not in names:
+        return transforms, None
+    pos = names.index('NormalizeImage')
+    if 'ToCHWImage' not in names[pos + 1:] or \
+            any(name != 'ToCHWImage' for name in names[pos + 1:]):
+        return transforms, None
+    param = transforms[pos]['NormalizeImage'] or {}
+    return transforms[:pos] + transforms[pos + 1:], param
+
+
+def create_device_normalize(config, mode='train'):
+    """
+    Returns:
+        the DeviceNormalize of the reader of mode if normalize_on_device is
+        set and the NormalizeImage of it can be moved, None otherwise
+    """
+    if not config.get('normalize_on_device', False):
+        return None
+    # the batch operators of the reader mix normalized float images
+    if mode == 'train' and config.get('use_mix', False) and \
+            not config.get('mix_on_device', False):
+        return None
+    params = config.get(mode.upper())
+    if params is None:
+        return None
+    _, param = split_normalize(params['transforms'])
+    if param is None:
+        return None
+    return DeviceNormalize(**param)
@@ -14,8 +14,9 @@
 
 # This code is based on https://github.com/akuxcw/GridMask
 
+import math
+
 import numpy as np
-from PIL import Image
 import pdb
 
 # curr
@@ -23,6 +24,43 @@ CURR_EPOCH = 0
 # epoch for the prob to be the upper limit
 NUM_EPOCHS = 240
 
+# pixel centers of the output region, relative to the rotation center
+_GRID_CACHE = {}
+
+
+def _centered_grid(h, w, hh, ww):
+    """
+    x and y of the pixel centers of the h x w center crop of a hh x ww
+    image, relative to the center of the image
+    """
+    key = (h, w, hh, ww)
+    grid = _GRID_CACHE.get(key)
+    if grid is None:
+        ys = np.arange((hh - h) // 2, (hh - h) // 2 + h) + 0.5 - hh / 2.0
+        xs = np.arange((ww - w) // 2, (ww - w) // 2 + w) + 0.5 - ww / 2.0
+        grid = (xs[np.newaxis, :], ys[:, np.newaxis])
+        _GRID_CACHE[key] = grid
+    return grid
+
+
+def _rotated_coords(h, w, hh, ww, angle):
+    """
+    integer coordinates in the hh x ww mask of the h x w center crop of the
+    mask rotated by angle degrees counter clockwise, as PIL rotate does
+    with nearest resampling; -1 if outside of the mask
+    """
+    xs, ys = _centered_grid(h, w, hh, ww)
+    rad = -math.radians(angle % 360.0)
+    cos = round(math.cos(rad), 15)
+    sin = round(math.sin(rad), 15)
+    src_x = cos * xs + sin * ys + ww / 2.0
+    src_y = -sin * xs + cos * ys + hh / 2.0
+    src_x = np.where(src_x < 0, -1, np.floor(src_x)).astype('int64')
+    src_y = np.where(src_y < 0, -1, np.floor(src_y)).astype('int64')
+    src_x[src_x >= ww] = -1
+    src_y[src_y >= hh] = -1
+    return src_x, src_y
+
 
 class GridMask(object):
     def __init__(self, d1=96, d2=224, rotate=1, ratio=0.5, mode=0, prob=1.):
@@ -58,30 +96,25 @@ class GridMask(object):
         d = np.random.randint(self.d1, self.d2)
         #d = self.d
         self.l = int(d * self.ratio + 0.5)
-        mask = np.ones((hh, ww), np.float32)
         st_h = np.random.randint(d)
         st_w = np.random.randint(d)
-        for i in range(-1, hh // d + 1):
-            s = d * i + st_h
-            t = s + self.l
-            s = max(min(s, hh), 0)
-            t = max(min(t, hh), 0)
-            mask[s:t, :] *= 0
-        for i in range(-1, ww // d + 1):
-            s = d * i + st_w
-            t = s + self.l
-            s = max(min(s, ww), 0)
-            t = max(min(t, ww), 0)
-            mask[:, s:t] *= 0
         r = np.random.randint(self.rotate)
-        mask = Image.fromarray(np.uint8(mask))
-        mask = mask.rotate(r)
-        mask = np.asarray(mask)
-        mask = mask[(hh - h) // 2:(hh - h) // 2 + h, (ww - w) // 2:(ww - w) //
-                    2 + w]
+
+        # a pixel of the hh x ww mask is masked if it is in a stripe of
+        # length l every d pixels from st_h or st_w, evaluated on the
+        # pixels of the rotated center crop only
+        if r % 360 == 0:
+            src_y = np.arange((hh - h) // 2, (hh - h) // 2 + h)[:, np.newaxis]
+            src_x = np.arange((ww - w) // 2, (ww - w) // 2 + w)[np.newaxis, :]
+            mask = ((src_y - st_h) % d >= self.l) & \
+                ((src_x - st_w) % d >= self.l)
+        else:
+            src_x, src_y = _rotated_coords(h, w, hh, ww, r)
+            mask = ((src_y - st_h) % d >= self.l) & \
+                ((src_x - st_w) % d >= self.l) & (src_x >= 0) & (src_y >= 0)
 
         if self.mode == 1:
-            mask = 1 - mask
+            mask = ~mask
 
         mask = np.expand_dims(mask, axis=0)
         img = (img * mask).astype(img.dtype)
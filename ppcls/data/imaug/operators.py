@@ -34,23 +34,92 @@ class OperatorParamError(ValueError):
     pass
 
 
+# start of frame markers, which carry the size of a jpeg image
+_JPEG_SOF_MARKERS = {
+    0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE,
+    0xCF
+}
+_REDUCED_DECODE_FLAGS = [(8, cv2.IMREAD_REDUCED_COLOR_8),
+                         (4, cv2.IMREAD_REDUCED_COLOR_4),
+                         (2, cv2.IMREAD_REDUCED_COLOR_2)]
+
+
+def jpeg_size(data):
+    """
+    parse (height, width) from the jpeg header without decoding
+
+    Returns:
+        None if data is not a jpeg image or the header is broken
+    """
+    if len(data) < 4 or data[0] != 0xFF or data[1] != 0xD8:
+        return None
+    i = 2
+    while i + 9 < len(data):
+        if data[i] != 0xFF:
+            return None
+        marker = data[i + 1]
+        if marker == 0xFF:
+            i += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD7:
+            i += 2
+            continue
+        if marker in _JPEG_SOF_MARKERS:
+            h = int(data[i + 5]) << 8 | int(data[i + 6])
+            w = int(data[i + 7]) << 8 | int(data[i + 8])
+            return h, w
+        i += 2 + (int(data[i + 2]) << 8 | int(data[i + 3]))
+    return None
+
+
 class DecodeImage(object):
-    """ decode image """
+    """ decode image
+
+        reduced_decode: decode jpeg images at 1/2, 1/4 or 1/8 resolution with
+            DCT scaling, the largest reduction that keeps the short side no
+            less than target_short_side is used. target_short_side is set
+            from the next resize or crop op by create_operators.
+    """
 
-    def __init__(self, to_rgb=True, to_np=False, channel_first=False):
+    def __init__(self,
+                 to_rgb=True,
+                 to_np=False,
+                 channel_first=False,
+                 reduced_decode=False,
+                 target_short_side=None):
         self.to_rgb = to_rgb
         self.to_np = to_np  # to numpy
         self.channel_first = channel_first  # only enabled when to_np is True
+        self.reduced_decode = reduced_decode
+        self.target_short_side = target_short_side
+
+    def _decode_flag(self, data):
+        if not self.reduced_decode or self.target_short_side is None:
+            return 1
+        size = jpeg_size(data)
+        if size is None:
+            return 1
+        short_side = min(size)
+        for factor, flag in _REDUCED_DECODE_FLAGS:
+            if short_side // factor >= self.target_short_side:
+                return flag
+        return 1
 
     def __call__(self, img):
-        if six.PY2:
-            assert type(img) is str and len(
-                img) > 0, "invalid input 'img' in DecodeImage"
+        if isinstance(img, np.ndarray):
+            # encoded bytes already viewed as uint8, e.g. sliced from a shard
+            assert img.dtype == np.uint8 and img.size > 0, \
+                "invalid input 'img' in DecodeImage"
+            data = img
         else:
-            assert type(img) is bytes and len(
-                img) > 0, "invalid input 'img' in DecodeImage"
-        data = np.frombuffer(img, dtype='uint8')
-        img = cv2.imdecode(data, 1)
+            if six.PY2:
+                assert type(img) is str and len(
+                    img) > 0, "invalid input 'img' in DecodeImage"
+            else:
+                assert type(img) is bytes and len(
+                    img) > 0, "invalid input 'img' in DecodeImage"
+            data = np.frombuffer(img, dtype='uint8')
+        img = cv2.imdecode(data, self._decode_flag(data))
         if self.to_rgb:
             assert img.shape[2] == 3, 'invalid shape of image[%s]' % (
                 img.shape)
@@ -114,6 +183,33 @@ class CropImage(object):
         return img[h_start:h_end, w_start:w_end, :]
 
 
+def sample_crop(img_h, img_w, scale, ratio):
+    """
+    sample the box of a random crop with its area in scale and its aspect
+    ratio in ratio of the image
+
+    Returns:
+        x, y, w, h of the box
+    """
+    aspect_ratio = math.sqrt(random.uniform(*ratio))
+    w = 1. * aspect_ratio
+    h = 1. / aspect_ratio
+
+    bound = min((float(img_w) / img_h) / (w**2),
+                (float(img_h) / img_w) / (h**2))
+    scale_max = min(scale[1], bound)
+    scale_min = min(scale[0], bound)
+
+    target_area = img_w * img_h * random.uniform(scale_min, scale_max)
+    target_size = math.sqrt(target_area)
+    w = int(target_size * w)
+    h = int(target_size * h)
+
+    i = random.randint(0, img_w - w)
+    j = random.randint(0, img_h - h)
+    return i, j, w, h
+
+
 class RandCropImage(object):
     """ random crop image """
 
@@ -130,33 +226,54 @@ class RandCropImage(object):
 
     def __call__(self, img):
         size = self.size
-        scale = self.scale
-        ratio = self.ratio
+        img_h, img_w = img.shape[:2]
+        i, j, w, h = sample_crop(img_h, img_w, self.scale, self.ratio)
+
+        img = img[j:j + h, i:i + w, :]
+        if self.interpolation is None:
+            return cv2.resize(img, size)
+        else:
+            return cv2.resize(img, size, interpolation=self.interpolation)
 
-        aspect_ratio = math.sqrt(random.uniform(*ratio))
-        w = 1. * aspect_ratio
-        h = 1. / aspect_ratio
 
-        img_h, img_w = img.shape[:2]
+class RandResizedCropFlip(object):
+    """
+    RandCropImage followed by RandFlipImage in one op, with the same random
+    crop and flip. The crop is resized from a view of the image and flipped
+    in place, so that the only copy is the output.
+    """
 
-        bound = min((float(img_w) / img_h) / (w**2),
-                    (float(img_h) / img_w) / (h**2))
-        scale_max = min(scale[1], bound)
-        scale_min = min(scale[0], bound)
+    def __init__(self,
+                 size,
+                 scale=None,
+                 ratio=None,
+                 interpolation=-1,
+                 flip_code=1):
+        self.interpolation = interpolation if interpolation >= 0 else None
+        if type(size) is int:
+            self.size = (size, size)  # (h, w)
+        else:
+            self.size = size
 
-        target_area = img_w * img_h * random.uniform(scale_min, scale_max)
-        target_size = math.sqrt(target_area)
-        w = int(target_size * w)
-        h = int(target_size * h)
+        self.scale = [0.08, 1.0] if scale is None else scale
+        self.ratio = [3. / 4., 4. / 3.] if ratio is None else ratio
+        assert flip_code in [-1, 0, 1
+                             ], "flip_code should be a value in [-1, 0, 1]"
+        self.flip_code = flip_code
 
-        i = random.randint(0, img_w - w)
-        j = random.randint(0, img_h - h)
+    def __call__(self, img):
+        img_h, img_w = img.shape[:2]
+        i, j, w, h = sample_crop(img_h, img_w, self.scale, self.ratio)
+        flip = random.randint(0, 1) == 1
 
         img = img[j:j + h, i:i + w, :]
         if self.interpolation is None:
-            return cv2.resize(img, size)
+            img = cv2.resize(img, self.size)
         else:
-            return cv2.resize(img, size, interpolation=self.interpolation)
+            img = cv2.resize(img, self.size, interpolation=self.interpolation)
+        if flip:
+            cv2.flip(img, self.flip_code, dst=img)
+        return img
 
 
 class RandFlipImage(object):
@@ -0,0 +1,131 @@
+# Copyright (c) 2020 PaddlePaddle Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import math
+
+from .operators import DecodeImage
+from .operators import ResizeImage
+from .operators import CropImage
+from .operators import RandCropImage
+from .operators import RandResizedCropFlip
+from .operators import NormalizeImage
+from .operators import ToCHWImage
+
+
+def transform(data, ops=[], profiler=None):
+    """
+    transform
+
+    Args:
+        profiler(TransformProfiler): records every op if given
+    """
+    if profiler is not None:
+        return profiler.transform(data, ops)
+    for op in ops:
+        data = op(data)
+    return data
+
+
+# operators whose output only depends on the input, every other operator
+# is treated as random
+DETERMINISTIC_OPS = (DecodeImage, ResizeImage, CropImage, NormalizeImage,
+                     ToCHWImage)
+
+
+def is_deterministic(op):
+    """ whether the output of op only depends on its input """
+    return isinstance(op, DETERMINISTIC_OPS)
+
+
+def split_operators(ops):
+    """
+    split ops into the deterministic prefix and the remaining suffix
+
+    Args:
+        ops(list): operators created by create_operators
+
+    Returns:
+        prefix(list), suffix(list)
+    """
+    num = 0
+    while num < len(ops) and is_deterministic(ops[num]):
+        num += 1
+    return ops[:num], ops[num:]
+
+
+def target_short_side(op):
+    """
+    minimum short side of the input that op needs to keep full quality,
+    None if it can not be inferred from op
+    """
+    if isinstance(op, ResizeImage):
+        if op.resize_short is not None:
+            return op.resize_short
+        return max(op.w, op.h)
+    if isinstance(op, (RandCropImage, RandResizedCropFlip)):
+        # the smallest crop is resized up to size, bound its short side
+        min_ratio = min(min(op.ratio), 1.0 / max(op.ratio))
+        return int(
+            math.ceil(max(op.size) / math.sqrt(op.scale[0] * min_ratio)))
+    return None
+
+
+def configure_reduced_decode(ops):
+    """
+    set the target size of DecodeImage with reduced_decode from the op that
+    follows it
+    """
+    for op, next_op in zip(ops[:-1], ops[1:]):
+        if isinstance(op, DecodeImage) and op.reduced_decode and \
+                op.target_short_side is None:
+            op.target_short_side = target_short_side(next_op)
+    return ops
+
+
+class TransformPipeline(object):
+    """
+    Apply ops to a sample, the output of the first num_cached ops is
+    materialized once per sample and kept in cache.
+
+    Args:
+        ops(list): operators created by create_operators
+        cache: object with get(key) and put(key, data), get returns a copy
+            of the cached data or None
+        num_cached(int): number of ops whose output is cached, the whole
+            deterministic prefix by default
+        profiler(TransformProfiler): records the ops that are run if given
+    """
+
+    def __init__(self, ops, cache=None, num_cached=None, profiler=None):
+        if num_cached is None:
+            num_cached = len(split_operators(ops)[0])
+        self.ops = ops
+        self.cache = cache if num_cached > 0 else None
+        self.prefix = ops[:num_cached]
+        self.suffix = ops[num_cached:]
+        self.profiler = profiler
+
+    def __call__(self, key, load):
+        """
+        Args:
+            key: key of the sample in cache, such as the sample index
+            load(callable): returns the raw input of the sample
+        """
+        if self.cache is None:
+            return transform(load(), self.ops, self.profiler)
+        data = self.cache.get(key)
+        if data is None:
+            data = transform(load(), self.prefix, self.profiler)
+            self.cache.put(key, data)
+        return transform(data, self.suffix, self.profiler)
@@ -18,10 +18,17 @@ from PIL import Image, ImageEnhance, ImageOps
 import numpy as np
 import random
 
+from .augment_ops import create_ops
+
 
 class RandAugment(object):
-    def __init__(self, num_layers=2, magnitude=5, fillcolor=(128, 128, 128)):
+    def __init__(self,
+                 num_layers=2,
+                 magnitude=5,
+                 fillcolor=(128, 128, 128),
+                 backend="pil"):
         self.num_layers = num_layers
+        self.backend = backend
         self.magnitude = magnitude
         self.max_level = 10
 
@@ -43,6 +50,14 @@ class RandAugment(object):
             "invert": 0
         }
 
+        if backend == "cv2":
+            # the same ops on uint8 ndarrays
+            self.func = create_ops(fillcolor)
+        else:
+            self.func = self._create_pil_ops(fillcolor)
+
+    def _create_pil_ops(self, fillcolor):
+        """ the ops on PIL images """
         # from https://stackoverflow.com/questions/5252170/
         # specify-image-filling-color-when-rotating-in-python-with-pil-and-setting-expand
         def rotate_with_fill(img, magnitude):
@@ -53,7 +68,7 @@ class RandAugment(object):
 
         rnd_ch_op = random.choice
 
-        self.func = {
+        return {
             "shearX": lambda img, magnitude: img.transform(
                 img.size,
                 Image.AFFINE,
@@ -14,7 +14,6 @@
 
 #This code is based on https://github.com/zhunzhong07/Random-Erasing
 
-import math
 import random
 
 import numpy as np
@@ -22,34 +21,36 @@ import numpy as np
 
 class RandomErasing(object):
     def __init__(self, EPSILON=0.5, sl=0.02, sh=0.4, r1=0.3,
-                 mean=[0., 0., 0.]):
+                 mean=[0., 0., 0.], attempts=100):
         self.EPSILON = EPSILON
         self.mean = mean
         self.sl = sl
         self.sh = sh
         self.r1 = r1
+        self.attempts = attempts
+        self._fill = np.array(mean, dtype='float32').reshape((-1, 1, 1))
 
     def __call__(self, img):
         if random.uniform(0, 1) > self.EPSILON:
             return img
 
-        for attempt in range(100):
-            area = img.shape[1] * img.shape[2]
-
-            target_area = random.uniform(self.sl, self.sh) * area
-            aspect_ratio = random.uniform(self.r1, 1 / self.r1)
-
-            h = int(round(math.sqrt(target_area * aspect_ratio)))
-            w = int(round(math.sqrt(target_area / aspect_ratio)))
-
-            if w < img.shape[2] and h < img.shape[1]:
-                x1 = random.randint(0, img.shape[1] - h)
-                y1 = random.randint(0, img.shape[2] - w)
-                if img.shape[0] == 3:
-                    img[0, x1:x1 + h, y1:y1 + w] = self.mean[0]
-                    img[1, x1:x1 + h, y1:y1 + w] = self.mean[1]
-                    img[2, x1:x1 + h, y1:y1 + w] = self.mean[2]
-                else:
-                    img[0, x1:x1 + h, y1:y1 + w] = self.mean[1]
-                return img
+        # sample the geometry of all the attempts at once, and erase the
+        # first one that fits in the image
+        area = img.shape[1] * img.shape[2]
+        target_area = np.random.uniform(self.sl, self.sh,
+                                        self.attempts) * area
+        aspect_ratio = np.random.uniform(self.r1, 1 / self.r1, self.attempts)
+        hs = np.round(np.sqrt(target_area * aspect_ratio)).astype('int64')
+        ws = np.round(np.sqrt(target_area / aspect_ratio)).astype('int64')
+        valid = np.flatnonzero((ws < img.shape[2]) & (hs < img.shape[1]))
+        if len(valid) == 0:
+            return img
+        h = int(hs[valid[0]])
+        w = int(ws[valid[0]])
+        x1 = random.randint(0, img.shape[1] - h)
+        y1 = random.randint(0, img.shape[2] - w)
+        if img.shape[0] == 3:
+            img[:, x1:x1 + h, y1:y1 + w] = self._fill
+        else:
+            img[0, x1:x1 + h, y1:y1 + w] = self.mean[1]
         return img
@@ -0,0 +1,226 @@
+# Copyright (c) 2020 PaddlePaddle Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import multiprocessing
+import os
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+__all__ = [
+    'TransformProfiler', 'create_transform_profiler', 'get_transform_profiler'
+]
+
+# fields of the statistics of an op in a process
+_COUNT, _TIME, _MAX_TIME, _ALLOC_COUNT, _ALLOC_BYTES = range(5)
+# the last input and output shapes, padded with -1
+_MAX_DIMS = 4
+_IN_SHAPE = 5
+_OUT_SHAPE = _IN_SHAPE + _MAX_DIMS
+_NUM_FIELDS = _OUT_SHAPE + _MAX_DIMS
+
+# profilers of the readers by mode, so that the training loop can log them
+_PROFILERS = {}
+
+
+def _shape(data):
+    """ shape of an ndarray or a PIL image, length of the encoded bytes """
+    if isinstance(data, np.ndarray):
+        return data.shape
+    if isinstance(data, (bytes, bytearray)):
+        return (len(data), )
+    size = getattr(data, 'size', None)
+    if isinstance(size, tuple):
+        # PIL image
+        return size[::-1] + (len(data.getbands()), )
+    return ()
+
+
+def _format_shape(dims):
+    dims = [int(d) for d in dims if d >= 0]
+    if len(dims) == 0:
+        return "-"
+    return "x".join(str(d) for d in dims)
+
+
+def _worker_slot():
+    """ 0 in the main process, worker id + 1 in the dataloader workers """
+    try:
+        from paddle.io import get_worker_info
+    except ImportError:
+        return 0
+    info = get_worker_info()
+    return 0 if info is None else info.id + 1
+
+
+class TransformProfiler(object):
+    """
+    Record the wall time, the input and output shapes and the newly
+    allocated output bytes of every op of the transforms.
+
+    The statistics are kept in shared memory with one slot per process,
+    so that every dataloader worker writes its own slot without locks and
+    the main process sums them. The memory is shared with the workers
+    forked after the profiler is created.
+
+    Args:
+        ops(list): operators created by create_operators
+        num_workers(int): number of dataloader workers
+    """
+
+    def __init__(self, ops, num_workers=0):
+        self.names = [op.__class__.__name__ for op in ops]
+        self._index = {id(op): idx for idx, op in enumerate(ops)}
+        self.num_slots = num_workers + 1
+        self._shared = multiprocessing.RawArray(
+            'd', self.num_slots * len(ops) * _NUM_FIELDS)
+        self._stats = np.frombuffer(
+            self._shared, dtype='float64').reshape(
+                (self.num_slots, len(ops), _NUM_FIELDS))
+        self.reset()
+        self._pid = None
+        self._slot = None
+
+    def _slot_stats(self):
+        pid = os.getpid()
+        if pid != self._pid:
+            self._pid = pid
+            self._slot = self._stats[min(_worker_slot(), self.num_slots - 1)]
+        return self._slot
+
+    def transform(self, data, ops):
+        """ transform of pipeline, with every op of the profiler recorded """
+        stats = self._slot_stats()
+        for op in ops:
+            idx = self._index.get(id(op))
+            if idx is None:
+                data = op(data)
+                continue
+            start = time.perf_counter()
+            out = op(data)
+            elapsed = time.perf_counter() - start
+
+            record = stats[idx]
+            record[_COUNT] += 1
+            record[_TIME] += elapsed
+            record[_MAX_TIME] = max(record[_MAX_TIME], elapsed)
+            if isinstance(out, np.ndarray) and \
+                    not (isinstance(data, np.ndarray) and
+                         np.may_share_memory(data, out)):
+                record[_ALLOC_COUNT] += 1
+                record[_ALLOC_BYTES] += out.nbytes
+            for pos, dims in ((_IN_SHAPE, _shape(data)),
+                              (_OUT_SHAPE, _shape(out))):
+                dims = dims[:_MAX_DIMS]
+                record[pos:pos + len(dims)] = dims
+                record[pos + len(dims):pos + _MAX_DIMS] = -1
+            data = out
+        return data
+
+    def reset(self):
+        self._stats[:] = 0
+
+    def summary(self):
+        """
+        Returns:
+            OrderedDict of op name to the count, total and max time in ms,
+            images/s, allocated MB per call and the last input and output
+            shapes of the op across processes, and "chain" for the whole
+            transforms. images/s is the throughput of a single process.
+        """
+        result = OrderedDict()
+        counts = self._stats[:, :, _COUNT].sum(axis=0)
+        totals = self._stats[:, :, _TIME].sum(axis=0)
+        for idx, name in enumerate(self.names):
+            if counts[idx] == 0:
+                continue
+            if name in result:
+                name = "{}_{}".format(name, idx)
+            stats = self._stats[:, idx]
+            # shapes of the last process that ran the op
+            last = stats[stats[:, _COUNT] > 0][-1]
+            result[name] = {
+                "count": int(counts[idx]),
+                "total_ms": totals[idx] * 1000,
+                "mean_ms": totals[idx] * 1000 / counts[idx],
+                "max_ms": stats[:, _MAX_TIME].max() * 1000,
+                "images_per_sec": counts[idx] / max(totals[idx], 1e-12),
+                "alloc_mb": stats[:, _ALLOC_BYTES].sum() / counts[idx] /
+                (1024 * 1024),
+                "input_shape":
+                _format_shape(last[_IN_SHAPE:_IN_SHAPE + _MAX_DIMS]),
+                "output_shape":
+                _format_shape(last[_OUT_SHAPE:_OUT_SHAPE + _MAX_DIMS]),
+            }
+        if result:
+            # ops after a cache hit run once per sample
+            count = int(counts.max())
+            total = totals.sum()
+            result["chain"] = {
+                "count": count,
+                "total_ms": total * 1000,
+                "mean_ms": total * 1000 / count,
+                "max_ms": None,
+                "images_per_sec": count / max(total, 1e-12),
+                "alloc_mb": self._stats[:, :, _ALLOC_BYTES].sum() / count /
+                (1024 * 1024),
+                "input_shape": None,
+                "output_shape": None,
+            }
+        return result
+
+    def report(self):
+        """ one line per op, with its share of the time of the transforms """
+        summary = self.summary()
+        if not summary:
+            return "no transform recorded"
+        total = summary["chain"]["total_ms"] or 1.0
+        lines = []
+        for name, s in summary.items():
+            line = "{:<20s} count: {:<8d} mean: {:.3f} ms, " \
+                "{:.1f} images/s, alloc: {:.3f} MB, total: {:.1f} ms " \
+                "({:.1f}%)".format(name, s["count"], s["mean_ms"],
+                                   s["images_per_sec"], s["alloc_mb"],
+                                   s["total_ms"], 100 * s["total_ms"] / total)
+            if s["input_shape"] is not None:
+                line += ", max: {:.3f} ms, {} -> {}".format(
+                    s["max_ms"], s["input_shape"], s["output_shape"])
+            lines.append(line)
+        return "\n".join(lines)
+
+
+def create_transform_profiler(params, ops):
+    """
+    create the profiler of the transforms of a reader if profile_transforms
+    is set in params, and keep it as the profiler of the reader mode
+
+    Args:
+        params(dict): reader params
+        ops(list): operators created from params['transforms']
+    """
+    if not params.get('profile_transforms', False):
+        return None
+    profiler = TransformProfiler(ops, params.get('num_workers', 0))
+    _PROFILERS[params.get('mode', 'train')] = profiler
+    return profiler
+
+
+def get_transform_profiler(mode='train'):
+    """
+    Returns:
+        the transform profiler of the last reader of mode, None if the
+        transforms are not profiled
+    """
+    return _PROFILERS.get(mode)
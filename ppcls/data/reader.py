@@ -18,10 +18,16 @@ import imghdr
 import os
 import signal
 
-from paddle.io import Dataset, DataLoader, DistributedBatchSampler
+from paddle.io import Dataset, IterableDataset, DataLoader
+from paddle.io import DistributedBatchSampler, get_worker_info
 
 from . import imaug
 from .imaug import transform
+from .imaug.device_operators import create_device_normalize
+from .imaug.device_operators import split_normalize
+from .imaug.transform_profiler import create_transform_profiler
+from .shard import ShardFile, iter_shard, shard_length
+from .cache import create_transform_pipeline
 from ppcls.utils import logger
 
 trainers_num = int(os.environ.get('PADDLE_TRAINERS_NUM', 1))
@@ -82,7 +88,11 @@ def check_params(params):
     assert os.path.isdir(data_dir), \
         "{} doesn't exist, please check datadir path".format(data_dir)
 
-    if params['mode'] != 'test':
+    if params.get('shard_list'):
+        shard_list = params['shard_list']
+        assert os.path.isfile(shard_list), \
+            "{} doesn't exist, please check shard list path".format(shard_list)
+    elif params['mode'] != 'test':
         file_list = params.get('file_list', '')
         assert os.path.isfile(file_list), \
             "{} doesn't exist, please check file list path".format(file_list)
@@ -141,6 +151,25 @@ def get_file_list(params):
     return full_lines
 
 
+def get_shard_list(params):
+    """
+    read shard paths from the shard list, paths are relative to data_dir
+
+    Args:
+        params(dict):
+    """
+    with open(params['shard_list']) as flist:
+        shard_names = [line.strip() for line in flist if line.strip()]
+    return [
+        os.path.join(params.get('data_dir', ''), name) for name in shard_names
+    ]
+
+
+def read_file(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
 def create_operators(params):
     """
     create operators based on the config
@@ -158,7 +187,7 @@ def create_operators(params):
         op = getattr(imaug, op_name)(**param)
         ops.append(op)
 
-    return ops
+    return imaug.configure_reduced_decode(ops)
 
 
 def term_mp(sig_num, frame):
@@ -180,6 +209,8 @@ class CommonDataset(Dataset):
         self.delimiter = params.get('delimiter', ' ')
         self.ops = create_operators(params['transforms'])
         self.num_samples = len(self.full_lines)
+        self.pipeline = create_transform_pipeline(params, self.ops,
+                                                  self.full_lines)
         return
 
     def __getitem__(self, idx):
@@ -187,9 +218,8 @@ class CommonDataset(Dataset):
             line = self.full_lines[idx]
             img_path, label = line.split(self.delimiter)
             img_path = os.path.join(self.params['data_dir'], img_path)
-            with open(img_path, 'rb') as f:
-                img = f.read()
-            return (transform(img, self.ops), int(label))
+            return (self.pipeline(idx, lambda: read_file(img_path)),
+                    int(label))
         except Exception as e:
             logger.error("data read faild: {}, exception info: {}".format(line,
                                                                           e))
@@ -199,6 +229,213 @@ class CommonDataset(Dataset):
         return self.num_samples
     
 
+class ShardDataset(Dataset):
+    """
+    Define dataset class for images packed by tools/pack_shards.py
+    """
+
+    def __init__(self, params):
+        self.params = params
+        self.mode = params.get("mode", "train")
+        self.shards = [ShardFile(path) for path in get_shard_list(params)]
+        self.ops = create_operators(params['transforms'])
+        self.cum_counts = np.cumsum([len(shard) for shard in self.shards])
+        self.num_samples = int(self.cum_counts[-1]) if self.shards else 0
+        self.pipeline = create_transform_pipeline(params, self.ops)
+        return
+
+    def __getitem__(self, idx):
+        try:
+            shard_id = int(np.searchsorted(self.cum_counts, idx, side='right'))
+            start = self.cum_counts[shard_id - 1] if shard_id > 0 else 0
+            label = int(self.shards[shard_id].labels[idx - start])
+            img = self.pipeline(
+                idx, lambda: self.shards[shard_id].get(idx - start)[0])
+            return (img, label)
+        except Exception as e:
+            logger.error("data read failed: sample {}, exception info: {}".
+                         format(idx, e))
+            return self.__getitem__(random.randint(0, len(self) - 1))
+
+    def __len__(self):
+        return self.num_samples
+
+
+def split_quota(caps, total):
+    """
+    split total into parts proportional to caps, each part <= its cap
+
+    Args:
+        caps(list): capacity of every part, sum(caps) >= total
+        total(int): number to split
+    """
+    cap_sum = sum(caps)
+    if cap_sum == 0:
+        return [0] * len(caps)
+    quota = [total * cap // cap_sum for cap in caps]
+    left = total - sum(quota)
+    for i, cap in enumerate(caps):
+        if left == 0:
+            break
+        if quota[i] < cap:
+            quota[i] += 1
+            left -= 1
+    return quota
+
+
+class ShardStreamDataset(IterableDataset):
+    """
+    Stream samples from shard files with sequential reads.
+
+    Shards are shuffled and dealt to trainers and dataloader workers every
+    epoch, samples are shuffled within a bounded buffer. In train mode each
+    trainer yields the same number of full batches, so that the data parallel
+    steps stay aligned.
+    """
+
+    def __init__(self, params, batch_size):
+        self.params = params
+        self.mode = params.get("mode", "train")
+        self.shard_paths = get_shard_list(params)
+        self.shard_counts = [shard_length(path) for path in self.shard_paths]
+        self.ops = create_operators(params['transforms'])
+        self.profiler = create_transform_profiler(params, self.ops)
+        self.batch_size = batch_size
+        self.shuffle = self.mode == "train"
+        self.drop_last = self.mode == "train"
+        self.seed = params.get('shuffle_seed')
+        self.buffer_size = params.get('shuffle_buffer_size', 1024)
+        self.epoch = 0
+        if trainers_num > 1 and self.shuffle and self.seed is None:
+            raise ShuffleSeedException()
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def _rng(self, worker_id=0):
+        if self.seed is None:
+            return np.random.RandomState()
+        seed = (self.seed * 1000003 + self.epoch * 9973 + trainer_id * 131 +
+                worker_id) % (2**32)
+        return np.random.RandomState(seed)
+
+    def _assign(self, num_workers):
+        """
+        shard ids of every worker and the number of samples it should yield
+        """
+        order = np.arange(len(self.shard_paths))
+        if self.shuffle:
+            # the same permutation on all trainers
+            rng = np.random.RandomState(None if self.seed is None else (
+                self.seed + self.epoch) % (2**32))
+            rng.shuffle(order)
+
+        assigns = []
+        for rank in range(trainers_num):
+            rank_shards = order[rank::trainers_num]
+            assigns.append([
+                rank_shards[worker_id::num_workers]
+                for worker_id in range(num_workers)
+            ])
+
+        def worker_samples(shard_ids):
+            return sum(self.shard_counts[i] for i in shard_ids)
+
+        if not self.drop_last:
+            return [(shard_ids, worker_samples(shard_ids))
+                    for shard_ids in assigns[trainer_id]]
+
+        caps = [[
+            worker_samples(shard_ids) // self.batch_size
+            for shard_ids in rank_assign
+        ] for rank_assign in assigns]
+        num_batches = min(sum(rank_caps) for rank_caps in caps)
+        quota = split_quota(caps[trainer_id], num_batches)
+        return [(shard_ids, num * self.batch_size)
+                for shard_ids, num in zip(assigns[trainer_id], quota)]
+
+    def num_batches(self, num_workers):
+        num_workers = max(num_workers, 1)
+        batches = 0
+        for _, num in self._assign(num_workers):
+            if self.drop_last:
+                batches += num // self.batch_size
+            else:
+                batches += (num + self.batch_size - 1) // self.batch_size
+        return batches
+
+    def _samples(self, shard_ids, rng):
+        buffer = []
+        for shard_id in shard_ids:
+            for sample in iter_shard(self.shard_paths[shard_id]):
+                if not self.shuffle:
+                    yield sample
+                elif len(buffer) < self.buffer_size:
+                    buffer.append(sample)
+                else:
+                    idx = rng.randint(len(buffer))
+                    sample, buffer[idx] = buffer[idx], sample
+                    yield sample
+        rng.shuffle(buffer)
+        for sample in buffer:
+            yield sample
+
+    def __iter__(self):
+        worker_info = get_worker_info()
+        worker_id = worker_info.id if worker_info is not None else 0
+        num_workers = worker_info.num_workers if worker_info is not None else 1
+        shard_ids, num = self._assign(num_workers)[worker_id]
+
+        rng = self._rng(worker_id)
+        last = None
+        # failed samples before the first good one, repeated by it
+        pending = 0
+        for img, label in self._samples(shard_ids, rng):
+            if num <= 0:
+                break
+            num -= 1
+            try:
+                last = (transform(img, self.ops, self.profiler), label)
+            except Exception as e:
+                logger.error("data read failed: sample of label {}, "
+                             "exception info: {}".format(label, e))
+                # keep the number of samples so that trainers stay aligned
+                if last is None:
+                    pending += 1
+                    continue
+            for _ in range(pending + 1):
+                yield last
+            pending = 0
+        if pending > 0:
+            raise RuntimeError(
+                "all the {} samples of the worker failed, the trainers can "
+                "not stay aligned".format(pending))
+
+
+class StreamingLoader(object):
+    """
+    Wrap the dataloader of ShardStreamDataset, advance its epoch every time
+    the loader is called and provide the number of batches.
+    """
+
+    def __init__(self, loader, dataset, num_workers, epoch=0):
+        self.loader = loader
+        self.dataset = dataset
+        self.num_workers = num_workers
+        self.epoch = epoch
+
+    def __call__(self):
+        self.dataset.set_epoch(self.epoch)
+        self.epoch += 1
+        return self.loader()
+
+    def __iter__(self):
+        return self()
+
+    def __len__(self):
+        return self.dataset.num_batches(self.num_workers)
+
+
 class MultiLabelDataset(Dataset):
     """
     Define dataset class for multilabel image classification
@@ -211,6 +448,8 @@ class MultiLabelDataset(Dataset):
         self.delimiter = params.get("delimiter", "\t")
         self.ops = create_operators(params["transforms"])
         self.num_samples = len(self.full_lines)
+        self.pipeline = create_transform_pipeline(params, self.ops,
+                                                  self.full_lines)
         return
 
     def __getitem__(self, idx):
@@ -218,13 +457,12 @@ class MultiLabelDataset(Dataset):
             line = self.full_lines[idx]
             img_path, label_str = line.split(self.delimiter)
             img_path = os.path.join(self.params["data_dir"], img_path)
-            with open(img_path, "rb") as f:
-                img = f.read()
 
             labels = label_str.split(',')
             labels = [int(i) for i in labels]
 
-            return (transform(img, self.ops), np.array(labels).astype("float32"))
+            return (self.pipeline(idx, lambda: read_file(img_path)),
+                    np.array(labels).astype("float32"))
         except Exception as e:
             logger.error("data read failed: {}, exception info: {}".format(line, e))
             return self.__getitem__(random.randint(0, len(self)))
@@ -254,35 +492,40 @@ class Reader:
 
         use_mix = config.get('use_mix')
         self.params['mode'] = mode
+        # ship uint8 images, program.create_feeds normalizes them on device
+        if create_device_normalize(config, mode) is not None:
+            self.params = dict(self.params)
+            self.params['transforms'] = split_normalize(self.params[
+                'transforms'])[0]
         self.shuffle = mode == "train"
 
         self.collate_fn = None
         self.batch_ops = []
-        if use_mix and mode == "train":
+        # with mix_on_device the batches are mixed in program.run instead
+        if use_mix and mode == "train" and not config.get('mix_on_device'):
             self.batch_ops = create_operators(self.params['mix'])
             self.collate_fn = self.mix_collate_fn
 
         self.places = places
         self.multilabel = config.get("multilabel", False)
+        self.start_epoch = config.get("last_epoch", -1) + 1
 
     def mix_collate_fn(self, batch):
-        batch = transform(batch, self.batch_ops)
-        # batch each field
-        slots = []
-        for items in batch:
-            for i, item in enumerate(items):
-                if len(slots) < len(items):
-                    slots.append([item])
-                else:
-                    slots[i].append(item)
-
-        return [np.stack(slot, axis=0) for slot in slots]
+        # stack once, the batch operators mix the stacked images in place
+        imgs = np.stack([items[0] for items in batch])
+        labels = np.array([items[1] for items in batch])
+        return list(transform((imgs, labels), self.batch_ops))
 
     def __call__(self):
         batch_size = int(self.params['batch_size']) // trainers_num
 
+        if self.params.get('streaming'):
+            return self.streaming_loader(batch_size)
+
         if self.multilabel:
             dataset = MultiLabelDataset(self.params)
+        elif self.params.get('shard_list'):
+            dataset = ShardDataset(self.params)
         else:
             dataset = CommonDataset(self.params)
 
@@ -301,6 +544,23 @@ class Reader:
             num_workers=self.params["num_workers"])
         return loader
 
+    def streaming_loader(self, batch_size):
+        assert self.params.get('shard_list'), \
+            "streaming mode reads shard files, please set shard_list"
+        dataset = ShardStreamDataset(self.params, batch_size)
+
+        is_train = self.params['mode'] == "train"
+        loader = DataLoader(
+            dataset,
+            batch_size=batch_size,
+            drop_last=is_train,
+            collate_fn=self.collate_fn if is_train else None,
+            places=self.places,
+            return_list=True,
+            num_workers=self.params["num_workers"])
+        return StreamingLoader(loader, dataset, self.params["num_workers"],
+                               self.start_epoch)
+
 
 signal.signal(signal.SIGINT, term_mp)
 signal.signal(signal.SIGTERM, term_mp)
@@ -0,0 +1,156 @@
+# copyright (c) 2020 PaddlePaddle Authors. All Rights Reserve.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Packed shard file format.
+
+A shard stores many encoded images in one large file so that the reader
+does one mmap per shard instead of one open()/read() per sample:
+
+    magic       8 bytes, b"PPCLSHD1"
+    num         uint64, number of samples
+    offsets     uint64[num + 1], byte offsets relative to the data section
+    labels      int64[num]
+    data        concatenated encoded image bytes
+"""
+
+import mmap
+import os
+
+import numpy as np
+
+SHARD_MAGIC = b"PPCLSHD1"
+
+
+class ShardFormatError(ValueError):
+    """ ShardFormatError
+    """
+    pass
+
+
+def _header_size(num):
+    return len(SHARD_MAGIC) + 8 + 8 * (num + 1) + 8 * num
+
+
+def write_shard(path, samples):
+    """
+    write a shard file
+
+    Args:
+        path(str): output shard path
+        samples(list): list of (image file path, int label)
+    """
+    sizes = np.array(
+        [os.path.getsize(img_path) for img_path, _ in samples],
+        dtype='uint64')
+    offsets = np.zeros(len(samples) + 1, dtype='uint64')
+    np.cumsum(sizes, out=offsets[1:])
+    labels = np.array([label for _, label in samples], dtype='int64')
+
+    with open(path, 'wb') as fout:
+        fout.write(SHARD_MAGIC)
+        fout.write(np.array([len(samples)], dtype='<u8').tobytes())
+        fout.write(offsets.astype('<u8').tobytes())
+        fout.write(labels.astype('<i8').tobytes())
+        for img_path, _ in samples:
+            with open(img_path, 'rb') as fin:
+                fout.write(fin.read())
+
+
+def read_header(fin):
+    """
+    read the header of an opened shard file
+
+    Returns:
+        offsets(np.ndarray), labels(np.ndarray), data_start(int)
+    """
+    magic = fin.read(len(SHARD_MAGIC))
+    if magic != SHARD_MAGIC:
+        raise ShardFormatError("invalid shard magic: {}".format(magic))
+    num = int(np.frombuffer(fin.read(8), dtype='<u8')[0])
+    offsets = np.frombuffer(fin.read(8 * (num + 1)), dtype='<u8')
+    labels = np.frombuffer(fin.read(8 * num), dtype='<i8')
+    if len(offsets) != num + 1 or len(labels) != num:
+        raise ShardFormatError("truncated shard header")
+    return offsets.astype('int64'), labels, _header_size(num)
+
+
+def shard_length(path):
+    """
+    number of samples in a shard, only the fixed part of the header is read
+    """
+    with open(path, 'rb') as fin:
+        if fin.read(len(SHARD_MAGIC)) != SHARD_MAGIC:
+            raise ShardFormatError("invalid shard magic: {}".format(path))
+        return int(np.frombuffer(fin.read(8), dtype='<u8')[0])
+
+
+class ShardFile(object):
+    """
+    Random access to a shard file through mmap
+
+    Args:
+        path(str): shard path
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as fin:
+            self.offsets, self.labels, self.data_start = read_header(fin)
+        self._mmap = None
+
+    def _open(self):
+        # opened lazily so that every dataloader worker maps its own view
+        with open(self.path, 'rb') as fin:
+            self._mmap = mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def get(self, idx):
+        """
+        Returns:
+            img(np.ndarray): uint8 view of the encoded image, no copy
+            label(int): label of the sample
+        """
+        if self._mmap is None:
+            self._open()
+        start = self.offsets[idx]
+        size = self.offsets[idx + 1] - start
+        img = np.frombuffer(
+            self._mmap,
+            dtype='uint8',
+            count=int(size),
+            offset=int(self.data_start + start))
+        return img, int(self.labels[idx])
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_mmap'] = None
+        return state
+
+
+def iter_shard(path):
+    """
+    read a shard sequentially, suitable for streaming from remote storage
+
+    Yields:
+        img(np.ndarray): uint8 encoded image
+        label(int): label of the sample
+    """
+    with open(path, 'rb') as fin:
+        offsets, labels, _ = read_header(fin)
+        sizes = np.diff(offsets)
+        for size, label in zip(sizes, labels):
+            img = np.frombuffer(fin.read(int(size)), dtype='uint8')
+            yield img, int(label)
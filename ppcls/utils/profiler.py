@@ -0,0 +1,300 @@
+# copyright (c) 2020 PaddlePaddle Authors. All Rights Reserve.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+__all__ = ['StageTimer', 'StepProfiler']
+
+# histogram bin edges in ms, 10 bins per decade from 10us to 100s
+DEFAULT_BIN_EDGES = np.logspace(-2, 5, 71)
+
+
+class _NullStage(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+class _Stage(object):
+    def __init__(self, timer, name):
+        self.timer = timer
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.timer.add(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class _Histogram(object):
+    def __init__(self, bin_edges):
+        self.bin_edges = bin_edges
+        # counts[0] and counts[-1] are underflow and overflow
+        self.counts = np.zeros(len(bin_edges) + 1, dtype='int64')
+        self.count = 0
+        self.total = 0.0
+        self.min = float('inf')
+        self.max = 0.0
+
+    def add(self, ms):
+        self.counts[np.searchsorted(self.bin_edges, ms, side='right')] += 1
+        self.count += 1
+        self.total += ms
+        self.min = min(self.min, ms)
+        self.max = max(self.max, ms)
+
+    def percentile(self, q):
+        """ upper edge of the bin holding the q-th percentile """
+        idx = int(
+            np.searchsorted(np.cumsum(self.counts), q / 100.0 * self.count))
+        if idx >= len(self.bin_edges):
+            return self.max
+        return min(float(self.bin_edges[idx]), self.max)
+
+
+class StageTimer(object):
+    """
+    Collect the time of named stages as histograms, e.g.
+
+        timer = StageTimer()
+        with timer.stage("decode"):
+            img = cv2.imdecode(data, 1)
+        print(timer.report())
+
+    The memory of a stage is fixed whatever the number of records, and
+    a disabled timer only costs a branch per stage. Thread safe.
+
+    Args:
+        enabled(bool): whether to record the stages
+        bin_edges(list): histogram bin edges in ms, log spaced by default
+    """
+
+    def __init__(self, enabled=True, bin_edges=None):
+        self.enabled = enabled
+        self.bin_edges = np.array(
+            bin_edges if bin_edges is not None else DEFAULT_BIN_EDGES,
+            dtype='float64')
+        self._stages = OrderedDict()
+        self._lock = threading.Lock()
+
+    def stage(self, name):
+        """ context manager that records the time of its body as name """
+        if not self.enabled:
+            return _NULL_STAGE
+        return _Stage(self, name)
+
+    def add(self, name, seconds):
+        if not self.enabled:
+            return
+        with self._lock:
+            hist = self._stages.get(name)
+            if hist is None:
+                hist = _Histogram(self.bin_edges)
+                self._stages[name] = hist
+            hist.add(seconds * 1000)
+
+    def reset(self):
+        with self._lock:
+            self._stages = OrderedDict()
+
+    def summary(self):
+        """
+        Returns:
+            OrderedDict of stage name to the count, total, mean, min, max and
+            p50/p90/p99 in ms, and the histogram counts of the stage
+        """
+        result = OrderedDict()
+        with self._lock:
+            for name, hist in self._stages.items():
+                result[name] = {
+                    "count": hist.count,
+                    "total_ms": hist.total,
+                    "mean_ms": hist.total / hist.count,
+                    "min_ms": hist.min,
+                    "max_ms": hist.max,
+                    "p50_ms": hist.percentile(50),
+                    "p90_ms": hist.percentile(90),
+                    "p99_ms": hist.percentile(99),
+                    "histogram": hist.counts.tolist(),
+                }
+        return result
+
+    def report(self):
+        """ one line per stage, with its share of the total time """
+        summary = self.summary()
+        total = sum(s["total_ms"] for s in summary.values()) or 1.0
+        lines = []
+        for name, s in summary.items():
+            lines.append(
+                "{:<16s} count: {:<8d} mean: {:.3f} ms, p50: {:.3f} ms, "
+                "p90: {:.3f} ms, p99: {:.3f} ms, total: {:.1f} ms ({:.1f}%)".
+                format(name, s["count"], s["mean_ms"], s["p50_ms"], s[
+                    "p90_ms"], s["p99_ms"], s["total_ms"], 100 * s[
+                        "total_ms"] / total))
+        return "\n".join(lines)
+
+    def save(self, path):
+        """ save the summary and the histogram bin edges as json """
+        with open(path, 'w') as fout:
+            json.dump(
+                {
+                    "bin_edges_ms": self.bin_edges.tolist(),
+                    "stages": self.summary()
+                },
+                fout,
+                indent=2)
+
+
+def get_synchronize():
+    """
+    Returns:
+        the function that waits for the pending device work, None if it is
+        not supported by the installed paddle
+    """
+    import paddle
+    cuda = getattr(paddle.device, "cuda", None)
+    synchronize = getattr(cuda, "synchronize", None)
+    if synchronize is not None and paddle.is_compiled_with_cuda():
+        return synchronize
+    return None
+
+
+class _ProfiledStage(object):
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        if self.profiler.synchronize is not None:
+            self.profiler.synchronize()
+        end = time.perf_counter()
+        self.profiler.add(self.name, self.start, end)
+        return False
+
+
+class StepProfiler(object):
+    """
+    Split every training step into named stages, summarized per epoch by a
+    StageTimer, and dump a chrome trace(chrome://tracing) of a window of
+    steps.
+
+    Args:
+        enabled(bool): whether to profile
+        sync(bool): wait for the device at the end of every stage, so that
+            asynchronous device time is charged to the stage that launched
+            it. Without it, the time shows up at the next sync point, e.g.
+            the metric fetch
+        trace_path(str): chrome trace json path, no trace if None
+        trace_start(int): first traced step, counted across epochs
+        trace_steps(int): number of traced steps
+        pid(int): process id in the trace, e.g. the trainer id
+    """
+
+    def __init__(self,
+                 enabled=True,
+                 sync=True,
+                 trace_path=None,
+                 trace_start=10,
+                 trace_steps=10,
+                 pid=0):
+        self.enabled = enabled
+        self.synchronize = get_synchronize() if enabled and sync else None
+        self.timer = StageTimer(enabled=enabled)
+        self.trace_path = trace_path
+        self.trace_start = trace_start
+        self.trace_end = trace_start + trace_steps
+        self.pid = pid
+        self.step = 0
+        self._events = []
+        self._trace_saved = False
+
+    def stage(self, name):
+        if not self.enabled:
+            return _NULL_STAGE
+        return _ProfiledStage(self, name)
+
+    def _tracing(self):
+        return self.trace_path is not None and \
+            self.trace_start <= self.step < self.trace_end
+
+    def add(self, name, start, end):
+        """ record a stage from start to end in time.perf_counter() """
+        self.timer.add(name, end - start)
+        if self._tracing():
+            self._events.append({
+                "name": name,
+                "ph": "X",
+                "ts": start * 1e6,
+                "dur": (end - start) * 1e6,
+                "pid": self.pid,
+                "tid": threading.get_ident() % 100000,
+                "args": {
+                    "step": self.step
+                },
+            })
+
+    def next_step(self):
+        if not self.enabled:
+            return
+        self.step += 1
+        if self.step == self.trace_end and self.trace_path is not None:
+            self.save_trace()
+            self._trace_saved = True
+
+    def close(self):
+        """
+        save the trace of the steps run so far if the run ended before the
+        end of the trace window
+
+        Returns:
+            number of the saved traced steps, None if the trace was already
+            saved or is not enabled
+        """
+        if not self.enabled or self.trace_path is None or self._trace_saved:
+            return None
+        self.save_trace()
+        self._trace_saved = True
+        return max(0, min(self.step, self.trace_end) - self.trace_start)
+
+    def save_trace(self):
+        dirname = os.path.dirname(self.trace_path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        with open(self.trace_path, 'w') as fout:
+            json.dump({"traceEvents": self._events}, fout)
+        self._events = []
+
+    def report(self):
+        """ summary of the stages since the last report """
+        report = self.timer.report()
+        self.timer.reset()
+        return report
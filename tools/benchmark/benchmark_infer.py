@@ -0,0 +1,261 @@
+# copyright (c) 2020 PaddlePaddle Authors. All Rights Reserve.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Inference benchmark suite.
+
+Every config of models x image sizes x batch sizes x cpu threads x mkldnn
+is run in its own process, so that the peak RSS of a config is not polluted
+by the others. The models are exported from ppcls.modeling.architectures
+with random weights unless --pretrained_dir is set, and are cached in
+--model_dir. The results are saved as json or csv by the extension of
+--output, e.g.
+
+    python tools/benchmark/benchmark_infer.py \
+        --models=ResNet50_vd,MobileNetV3_large_x1_0 \
+        --batch_sizes=1,8,32 --cpu_threads=1,4 --mkldnn=False,True \
+        --output=benchmark.csv
+"""
+
+import argparse
+import csv
+import itertools
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+__dir__ = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(__dir__)
+sys.path.append(os.path.abspath(os.path.join(__dir__, '../..')))
+
+import numpy as np
+
+RESULT_PREFIX = "BENCHMARK_RESULT "
+
+
+def str2bool(v):
+    return v.lower() in ("true", "t", "1")
+
+
+def parse_list(value, type_fn=str):
+    return [type_fn(v.strip()) for v in value.split(',') if v.strip()]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--models", type=str, default="ResNet50_vd")
+    parser.add_argument("--img_sizes", type=str, default="224")
+    parser.add_argument("--batch_sizes", type=str, default="1,8")
+    parser.add_argument("--cpu_threads", type=str, default="1,4")
+    parser.add_argument("--mkldnn", type=str, default="False,True")
+    parser.add_argument("--use_gpu", type=str2bool, default=False)
+    parser.add_argument("--gpu_mem", type=int, default=8000)
+    parser.add_argument("--class_dim", type=int, default=1000)
+    parser.add_argument("--warmup_num", type=int, default=10)
+    parser.add_argument("--test_num", type=int, default=100)
+    parser.add_argument(
+        "--pretrained_dir",
+        type=str,
+        default=None,
+        help="Load {pretrained_dir}/{model}_pretrained if it exists")
+    parser.add_argument(
+        "--model_dir", type=str, default="./output/benchmark_infer")
+    parser.add_argument(
+        "--output", type=str, default="./output/benchmark_infer.json")
+
+    # internal, run a single job in this process
+    parser.add_argument("--job", type=str, default=None)
+    return parser.parse_args()
+
+
+def peak_rss_mb():
+    # ru_maxrss is in KB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def export_job(config):
+    import paddle
+    from paddle.jit import to_static
+    from ppcls.modeling import architectures
+    from ppcls.utils.save_load import load_dygraph_pretrain
+    from tools.export_model import Net
+
+    net = architectures.__dict__[config["model"]]
+    model = Net(net, config["class_dim"], config["model"])
+    if config["pretrained_model"]:
+        load_dygraph_pretrain(model.pre_net, path=config["pretrained_model"])
+    model.eval()
+    model = to_static(
+        model,
+        input_spec=[
+            paddle.static.InputSpec(
+                shape=[None, 3, config["img_size"], config["img_size"]],
+                dtype='float32')
+        ])
+    paddle.jit.save(model, os.path.join(config["output_path"], "inference"))
+    return {}
+
+
+def predict_job(config):
+    from tools.infer.predict import Predictor
+    from tools.infer.utils import latency_stats
+
+    args = argparse.Namespace(
+        model_file=config["model_file"],
+        params_file=config["params_file"],
+        use_gpu=config["use_gpu"],
+        gpu_mem=config["gpu_mem"],
+        enable_mkldnn=config["mkldnn"],
+        cpu_num_threads=config["cpu_threads"],
+        batch_size=config["batch_size"],
+        ir_optim=True,
+        use_tensorrt=False,
+        use_fp16=False,
+        enable_profile=False)
+    start_time = time.time()
+    predictor = Predictor(args)
+    load_time = time.time() - start_time
+
+    inputs = np.random.rand(config["batch_size"], 3, config["img_size"],
+                            config["img_size"]).astype('float32')
+    for _ in range(config["warmup_num"]):
+        predictor.predict(inputs)
+    latencies = []
+    for _ in range(config["test_num"]):
+        start_time = time.time()
+        predictor.predict(inputs)
+        latencies.append(time.time() - start_time)
+
+    result = latency_stats(latencies, config["batch_size"])
+    result["load_time"] = load_time
+    return result
+
+
+def run_job(config):
+    """ run a job in a new process and return its result """
+    cmd = [
+        sys.executable, os.path.abspath(__file__), "--job", json.dumps(config)
+    ]
+    proc = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    for line in proc.stdout.decode('utf8').splitlines():
+        if line.startswith(RESULT_PREFIX):
+            return json.loads(line[len(RESULT_PREFIX):])
+    raise RuntimeError("job {} failed:\n{}".format(
+        config, proc.stderr.decode('utf8')[-2000:]))
+
+
+def export_models(args):
+    """
+    Returns:
+        dict of (model, img_size) to the exported model dir
+    """
+    model_dirs = {}
+    for model, img_size in itertools.product(
+            parse_list(args.models), parse_list(args.img_sizes, int)):
+        output_path = os.path.join(args.model_dir, "{}_{}".format(model,
+                                                                   img_size))
+        model_dirs[(model, img_size)] = output_path
+        if os.path.exists(os.path.join(output_path, "inference.pdmodel")):
+            continue
+        pretrained_model = None
+        if args.pretrained_dir:
+            path = os.path.join(args.pretrained_dir,
+                                "{}_pretrained".format(model))
+            if os.path.exists(path + ".pdparams"):
+                pretrained_model = path
+        print("export {} with image size {} to {}".format(model, img_size,
+                                                          output_path))
+        run_job({
+            "type": "export",
+            "model": model,
+            "img_size": img_size,
+            "class_dim": args.class_dim,
+            "pretrained_model": pretrained_model,
+            "output_path": output_path,
+        })
+    return model_dirs
+
+
+def save_results(results, path):
+    dirname = os.path.dirname(path)
+    if dirname:
+        os.makedirs(dirname, exist_ok=True)
+    if path.endswith(".csv"):
+        with open(path, 'w', newline='') as fout:
+            writer = csv.DictWriter(fout, fieldnames=list(results[0].keys()))
+            writer.writeheader()
+            writer.writerows(results)
+    else:
+        with open(path, 'w') as fout:
+            json.dump(results, fout, indent=2)
+
+
+def main(args):
+    model_dirs = export_models(args)
+    mkldnn_list = [False] if args.use_gpu else parse_list(args.mkldnn,
+                                                          str2bool)
+    threads_list = [1] if args.use_gpu else parse_list(args.cpu_threads, int)
+    results = []
+    for ((model, img_size), model_dir), batch_size, cpu_threads, mkldnn in \
+            itertools.product(sorted(model_dirs.items()),
+                              parse_list(args.batch_sizes, int),
+                              threads_list, mkldnn_list):
+        config = {
+            "model": model,
+            "img_size": img_size,
+            "batch_size": batch_size,
+            "use_gpu": args.use_gpu,
+            "cpu_threads": cpu_threads,
+            "mkldnn": mkldnn,
+        }
+        job = dict(config)
+        job.update({
+            "type": "predict",
+            "model_file": os.path.join(model_dir, "inference.pdmodel"),
+            "params_file": os.path.join(model_dir, "inference.pdiparams"),
+            "gpu_mem": args.gpu_mem,
+            "warmup_num": args.warmup_num,
+            "test_num": args.test_num,
+        })
+        try:
+            config.update(run_job(job))
+        except RuntimeError as e:
+            print(e)
+            continue
+        print("{model}\timage size: {img_size}\tbatch size: {batch_size}\t"
+              "cpu threads: {cpu_threads}\tmkldnn: {mkldnn}\t"
+              "p50(ms): {latency_p50:.3f}\tp90(ms): {latency_p90:.3f}\t"
+              "p99(ms): {latency_p99:.3f}\t"
+              "throughput(images/s): {throughput:.2f}\t"
+              "peak rss(MB): {peak_rss_mb:.1f}".format(**config))
+        results.append(config)
+
+    if len(results) > 0:
+        save_results(results, args.output)
+        print("save the results to {}".format(args.output))
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.job is not None:
+        config = json.loads(args.job)
+        if config["type"] == "export":
+            result = export_job(config)
+        else:
+            result = predict_job(config)
+        result["peak_rss_mb"] = peak_rss_mb()
+        print(RESULT_PREFIX + json.dumps(result))
+    else:
+        main(args)
@@ -0,0 +1,124 @@
+# copyright (c) 2020 PaddlePaddle Authors. All Rights Reserve.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Transform benchmark.
+
+Replay the TRAIN and VALID transforms of a config over the images of a
+folder in a single process, and report the time, images/s and allocated
+memory of every op and of the whole chain, e.g.
+
+    python tools/benchmark/benchmark_transforms.py \
+        -c configs/ResNet/ResNet50_vd.yaml --image_dir=./dataset/samples \
+        --modes=train,valid --epochs=3 --output=transforms.json
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+__dir__ = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(__dir__)
+sys.path.append(os.path.abspath(os.path.join(__dir__, '../..')))
+
+import numpy as np
+
+from ppcls.data.imaug import transform
+from ppcls.data.imaug import TransformProfiler
+from ppcls.data.reader import create_operators, read_file
+from ppcls.utils.config import get_config
+
+IMAGE_EXTS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-c", "--config", type=str, required=True)
+    parser.add_argument(
+        '-o',
+        '--override',
+        action='append',
+        default=[],
+        help='config options to be overridden')
+    parser.add_argument("--image_dir", type=str, required=True)
+    parser.add_argument("--modes", type=str, default="train,valid")
+    parser.add_argument(
+        "--num_images",
+        type=int,
+        default=200,
+        help="number of images read from image_dir")
+    parser.add_argument("--epochs", type=int, default=3)
+    parser.add_argument(
+        "--warmup",
+        type=int,
+        default=10,
+        help="number of images transformed before timing")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=str, default=None)
+    return parser.parse_args()
+
+
+def load_images(image_dir, num_images):
+    """ encoded bytes of the images, as the input of DecodeImage """
+    paths = []
+    for root, _, files in os.walk(image_dir):
+        for name in sorted(files):
+            if name.lower().endswith(IMAGE_EXTS):
+                paths.append(os.path.join(root, name))
+    paths = sorted(paths)[:num_images]
+    assert len(paths) > 0, "no image found in {}".format(image_dir)
+    return [read_file(path) for path in paths]
+
+
+def benchmark(ops, images, epochs, warmup):
+    for img in images[:warmup]:
+        transform(img, ops)
+    profiler = TransformProfiler(ops)
+    for _ in range(epochs):
+        for img in images:
+            transform(img, ops, profiler)
+    return profiler
+
+
+def main(args):
+    config = get_config(args.config, overrides=args.override, show=False)
+    random.seed(args.seed)
+    np.random.seed(args.seed)
+    images = load_images(args.image_dir, args.num_images)
+    print("benchmark the transforms on {} images of {}".format(
+        len(images), args.image_dir))
+
+    results = {}
+    for mode in [m.strip() for m in args.modes.split(',') if m.strip()]:
+        params = config.get(mode.upper())
+        if params is None:
+            print("no {} section in {}, skip".format(mode.upper(),
+                                                      args.config))
+            continue
+        ops = create_operators(params['transforms'])
+        profiler = benchmark(ops, images, args.epochs, args.warmup)
+        print("{}:\n{}".format(mode, profiler.report()))
+        results[mode] = profiler.summary()
+
+    if args.output and results:
+        dirname = os.path.dirname(args.output)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        with open(args.output, 'w') as fout:
+            json.dump(results, fout, indent=2)
+        print("save the results to {}".format(args.output))
+
+
+if __name__ == "__main__":
+    main(parse_args())
@@ -30,6 +30,7 @@ from ppcls.utils import accuracy_score
 from ppcls.utils import mean_average_precision
 from ppcls.utils import precision_recall_fscore
 from ppcls.data import Reader
+from ppcls.data.imaug.device_operators import create_device_normalize
 import program
 
 import numpy as np
@@ -72,6 +73,7 @@ def main(args, return_dict={}):
 
     init_model(config, net, optimizer=None)
     valid_dataloader = Reader(config, 'valid', places=place)()
+    normalize = create_device_normalize(config, 'valid')
     net.eval()
     with paddle.no_grad():
         if not multilabel:
@@ -85,7 +87,7 @@ def main(args, return_dict={}):
             targets = []
             for _, batch in enumerate(valid_dataloader()):
                 feeds = program.create_feeds(batch, False, config.classes_num,
-                                             multilabel)
+                                             multilabel, normalize)
                 out = net(feeds["image"])
                 out = F.sigmoid(out)
 
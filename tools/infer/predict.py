@@ -13,6 +13,10 @@
 # limitations under the License.
 
 import os
+import copy
+import itertools
+import threading
+from queue import Queue
 import numpy as np
 import cv2
 import time
@@ -20,17 +24,24 @@ import time
 import sys
 sys.path.insert(0, ".")
 from ppcls.utils import logger
-from tools.infer.utils import parse_args, get_image_list, create_paddle_predictor, preprocess, postprocess
+from ppcls.utils.profiler import StageTimer
+from tools.infer.utils import parse_args, get_image_list, create_paddle_predictor, create_preprocessor, postprocess, latency_stats, imread
 
 
 class Predictor(object):
-    def __init__(self, args):
+    def __init__(self, args, paddle_predictor=None, timer=None):
         # HALF precission predict only work when using tensorrt
         if args.use_fp16 is True:
             assert args.use_tensorrt is True
         self.args = args
+        if timer is None:
+            timer = StageTimer(
+                enabled=getattr(args, "enable_stage_timer", False))
+        self.timer = timer
 
-        self.paddle_predictor = create_paddle_predictor(args)
+        if paddle_predictor is None:
+            paddle_predictor = create_paddle_predictor(args)
+        self.paddle_predictor = paddle_predictor
         input_names = self.paddle_predictor.get_input_names()
         self.input_tensor = self.paddle_predictor.get_input_handle(input_names[
             0])
@@ -40,34 +51,53 @@ class Predictor(object):
             output_names[0])
 
     def predict(self, batch_input):
-        self.input_tensor.copy_from_cpu(batch_input)
-        self.paddle_predictor.run()
-        batch_output = self.output_tensor.copy_to_cpu()
+        with self.timer.stage("copy_from_cpu"):
+            self.input_tensor.copy_from_cpu(batch_input)
+        with self.timer.stage("run"):
+            self.paddle_predictor.run()
+        with self.timer.stage("copy_to_cpu"):
+            batch_output = self.output_tensor.copy_to_cpu()
         return batch_output
 
+    def report_stages(self):
+        """ log the stage timer and save it to args.stage_timer_output """
+        if not self.timer.enabled:
+            return
+        logger.info("time of the inference stages:\n{}".format(
+            self.timer.report()))
+        output = getattr(self.args, "stage_timer_output", None)
+        if output:
+            self.timer.save(output)
+            logger.info("save the stage timer to {}".format(output))
+
     def normal_predict(self):
         image_list = get_image_list(self.args.image_file)
-        batch_input_list = []
+        preprocessor = create_preprocessor(self.args)
+        batch_input = preprocessor.alloc_batch(self.args.batch_size)
+        timer = self.timer if self.timer.enabled else None
         img_name_list = []
-        cnt = 0
         for idx, img_path in enumerate(image_list):
-            img = cv2.imread(img_path)
+            img = imread(img_path, timer)
             if img is None:
                 logger.warning(
                     "Image file failed to read and has been skipped. The path: {}".
                     format(img_path))
-                continue
             else:
-                img = img[:, :, ::-1]
-                img = preprocess(img, args)
-                batch_input_list.append(img)
+                preprocessor(
+                    img,
+                    out=batch_input[len(img_name_list)],
+                    bgr=True,
+                    timer=timer)
                 img_name = img_path.split("/")[-1]
                 img_name_list.append(img_name)
-                cnt += 1
 
-            if cnt % args.batch_size == 0 or (idx + 1) == len(image_list):
-                batch_outputs = self.predict(np.array(batch_input_list))
-                batch_result_list = postprocess(batch_outputs, self.args.top_k)
+            if len(img_name_list) == self.args.batch_size or (
+                    idx + 1 == len(image_list) and len(img_name_list) > 0):
+                batch_outputs = self.predict(
+                    batch_input[:len(img_name_list)])
+                with self.timer.stage("postprocess"):
+                    batch_result_list = postprocess(batch_outputs,
+                                                    self.args.top_k)
 
                 for number, result_dict in enumerate(batch_result_list):
                     filename = img_name_list[number]
@@ -78,26 +108,130 @@ class Predictor(object):
                         "File:{}, Top-{} result: class id(s): {}, score(s): {}".
                         format(filename, self.args.top_k, clas_ids,
                                scores_str))
-                batch_input_list = []
                 img_name_list = []
 
-    def benchmark_predict(self):
-        test_num = 500
-        test_time = 0.0
-        for i in range(0, test_num + 10):
-            inputs = np.random.rand(args.batch_size, 3, 224,
-                                    224).astype(np.float32)
+    def benchmark_predict(self, test_num=500, warmup_num=10):
+        args = self.args
+        inputs = np.random.rand(args.batch_size, 3, args.resize,
+                                args.resize).astype(np.float32)
+        latencies = []
+        for i in range(0, test_num + warmup_num):
             start_time = time.time()
             batch_output = self.predict(inputs).flatten()
-            if i >= 10:
-                test_time += time.time() - start_time
-            time.sleep(0.01)  # sleep for T4 GPU
+            if i >= warmup_num:
+                latencies.append(time.time() - start_time)
+            if args.use_gpu:
+                time.sleep(0.01)  # sleep for T4 GPU
+        stats = latency_stats(latencies, args.batch_size)
 
         fp_message = "FP16" if args.use_fp16 else "FP32"
         trt_msg = "using tensorrt" if args.use_tensorrt else "not using tensorrt"
-        print("{0}\t{1}\t{2}\tbatch size: {3}\ttime(ms): {4}".format(
-            args.model, trt_msg, fp_message, args.batch_size, 1000 * test_time
-            / test_num))
+        print("{0}\t{1}\t{2}\tbatch size: {3}\ttime(ms): {4:.3f}\t"
+              "p50(ms): {5:.3f}\tp90(ms): {6:.3f}\tp99(ms): {7:.3f}\t"
+              "throughput(images/s): {8:.2f}".format(
+                  args.model, trt_msg, fp_message, args.batch_size, stats[
+                      "latency_mean"], stats["latency_p50"], stats[
+                          "latency_p90"], stats["latency_p99"], stats[
+                              "throughput"]))
+        return stats
+
+
+class PredictorPool(object):
+    """
+    A pool of predictors that run concurrently, e.g. to saturate a many-core
+    CPU with several MKL-DNN predictors. The first predictor is created from
+    args and the others are cloned from it, so they share the weights. Every
+    predictor uses args.cpu_num_threads math library threads.
+
+    Args:
+        args: same as Predictor
+        num_predictors(int): number of predictors
+        dispatch(str): "least_loaded" runs a request on any idle predictor,
+            "round_robin" runs requests on the predictors in turn
+    """
+
+    def __init__(self, args, num_predictors=1, dispatch="least_loaded"):
+        assert dispatch in ["least_loaded", "round_robin"], \
+            "unsupported dispatch: {}".format(dispatch)
+        self.args = args
+        self.dispatch = dispatch
+        self.predictors = [Predictor(args)]
+        self.timer = self.predictors[0].timer
+        for _ in range(num_predictors - 1):
+            paddle_predictor = self.predictors[0].paddle_predictor.clone()
+            self.predictors.append(
+                Predictor(args, paddle_predictor, self.timer))
+
+        self._idle = Queue()
+        for idx in range(num_predictors):
+            self._idle.put(idx)
+        self._next = itertools.count()
+        self._locks = [threading.Lock() for _ in range(num_predictors)]
+
+    def __len__(self):
+        return len(self.predictors)
+
+    def predict(self, batch_input):
+        """ thread safe, at most len(self) calls run at the same time """
+        if self.dispatch == "least_loaded":
+            idx = self._idle.get()
+            try:
+                return self.predictors[idx].predict(batch_input)
+            finally:
+                self._idle.put(idx)
+        idx = next(self._next) % len(self.predictors)
+        with self._locks[idx]:
+            return self.predictors[idx].predict(batch_input)
+
+
+def parse_sizes(sizes):
+    return [int(size) for size in sizes.split(',') if size.strip()]
+
+
+def benchmark_pool(args, test_num=100, warmup_num=10):
+    """
+    measure the throughput of every (number of predictors, cpu threads)
+    config in args.benchmark_pool_sizes x args.benchmark_cpu_threads
+    """
+    inputs = np.random.rand(args.batch_size, 3, args.resize,
+                            args.resize).astype(np.float32)
+    results = []
+    for num_predictors, cpu_num_threads in itertools.product(
+            parse_sizes(args.benchmark_pool_sizes),
+            parse_sizes(args.benchmark_cpu_threads)):
+        pool_args = copy.copy(args)
+        pool_args.cpu_num_threads = cpu_num_threads
+        pool = PredictorPool(pool_args, num_predictors, args.dispatch)
+        for predictor in pool.predictors:
+            for _ in range(warmup_num):
+                predictor.predict(inputs)
+
+        def client():
+            for _ in range(test_num):
+                pool.predict(inputs)
+
+        clients = [
+            threading.Thread(target=client) for _ in range(num_predictors)
+        ]
+        start_time = time.time()
+        for t in clients:
+            t.start()
+        for t in clients:
+            t.join()
+        elapse = time.time() - start_time
+        throughput = num_predictors * test_num * args.batch_size / elapse
+        results.append((throughput, num_predictors, cpu_num_threads))
+        print("predictors: {}\tcpu threads: {}\tbatch size: {}\t"
+              "throughput(images/s): {:.2f}".format(
+                  num_predictors, cpu_num_threads, args.batch_size,
+                  throughput))
+        del pool
+
+    throughput, num_predictors, cpu_num_threads = max(results)
+    print("best config: predictors: {}\tcpu threads: {}\t"
+          "throughput(images/s): {:.2f}".format(num_predictors,
+                                                 cpu_num_threads, throughput))
+    return results
 
 
 if __name__ == "__main__":
@@ -109,9 +243,14 @@ if __name__ == "__main__":
         args.params_file
     ), "The path of 'params_file' does not exist: {}".format(args.params_file)
 
+    if args.enable_pool_benchmark:
+        benchmark_pool(args)
+        sys.exit(0)
+
     predictor = Predictor(args)
     if not args.enable_benchmark:
         predictor.normal_predict()
+        predictor.report_stages()
     else:
         assert args.model is not None
         predictor.benchmark_predict()
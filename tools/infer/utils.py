@@ -15,7 +15,9 @@
 import os
 import argparse
 import base64
+import json
 import shutil
+import struct
 import cv2
 import numpy as np
 
@@ -48,11 +50,32 @@ def parse_args():
     parser.add_argument("--gpu_mem", type=int, default=8000)
     parser.add_argument("--enable_profile", type=str2bool, default=False)
     parser.add_argument("--enable_benchmark", type=str2bool, default=False)
+    parser.add_argument(
+        "--enable_stage_timer",
+        type=str2bool,
+        default=False,
+        help="Record the time of every inference stage as histograms")
+    parser.add_argument("--stage_timer_output", type=str, default=None)
     parser.add_argument("--top_k", type=int, default=1)
     parser.add_argument("--enable_mkldnn", type=str2bool, default=False)
     parser.add_argument("--cpu_num_threads", type=int, default=10)
     parser.add_argument("--hubserving", type=str2bool, default=False)
 
+    # params for predictor pool
+    parser.add_argument(
+        "--dispatch",
+        type=str,
+        default="least_loaded",
+        choices=["least_loaded", "round_robin"])
+    parser.add_argument(
+        "--enable_pool_benchmark",
+        type=str2bool,
+        default=False,
+        help="Sweep the number of predictors x cpu threads for throughput")
+    parser.add_argument("--benchmark_pool_sizes", type=str, default="1,2,4")
+    parser.add_argument(
+        "--benchmark_cpu_threads", type=str, default="1,2,4,8")
+
     # params for infer
     parser.add_argument("--model", type=str)
     parser.add_argument("--pretrained_model", type=str)
@@ -73,6 +96,13 @@ def parse_args():
 
     # parameters for test hubserving
     parser.add_argument("--server_url", type=str)
+    parser.add_argument(
+        "--hubserving_format",
+        type=str,
+        default="tensor",
+        choices=["tensor", "uint8", "jpeg"],
+        help="tensor: preprocessed float32 batch; uint8: resized and cropped "
+        "uint8 images; jpeg: encoded image files, decoded by the server")
 
     return parser.parse_args()
 
@@ -108,55 +138,195 @@ def create_paddle_predictor(args):
     return predictor
 
 
-def preprocess(img, args):
-    resize_op = ResizeImage(resize_short=args.resize_short)
-    img = resize_op(img)
-    crop_op = CropImage(size=(args.resize, args.resize))
-    img = crop_op(img)
-    if args.normalize:
-        img_mean = [0.485, 0.456, 0.406]
-        img_std = [0.229, 0.224, 0.225]
-        img_scale = 1.0 / 255.0
-        normalize_op = NormalizeImage(
-            scale=img_scale, mean=img_mean, std=img_std)
-        img = normalize_op(img)
-    tensor_op = ToTensor()
-    img = tensor_op(img)
-    return img
+def latency_stats(latencies, batch_size=1):
+    """
+    summarize the latencies of repeated runs
+
+    Args:
+        latencies(list): seconds of every run
+        batch_size(int): number of images of every run
+
+    Returns:
+        dict: mean, p50, p90 and p99 latency in ms, throughput in images/s
+    """
+    latencies = np.array(latencies, dtype='float64') * 1000
+    p50, p90, p99 = np.percentile(latencies, [50, 90, 99])
+    return {
+        "latency_mean": float(latencies.mean()),
+        "latency_p50": float(p50),
+        "latency_p90": float(p90),
+        "latency_p99": float(p99),
+        "throughput": float(batch_size * len(latencies) * 1000 /
+                            latencies.sum()),
+    }
+
+
+class Preprocessor(object):
+    """
+    Fused resize short, center crop, normalize and HWC to CHW.
+    The normalization is precomputed as one multiply-add per channel and
+    written straight into the CHW output, e.g. one row of a batch buffer.
+    """
+
+    def __init__(self,
+                 resize_short=256,
+                 resize=224,
+                 normalize=True,
+                 scale=None,
+                 mean=None,
+                 std=None):
+        self.resize_op = ResizeImage(resize_short=resize_short)
+        self.crop_op = CropImage(size=(resize, resize))
+        self.size = resize
+        scale = np.float32(scale if scale is not None else 1.0 / 255.0)
+        mean = np.array(
+            mean if mean is not None else [0.485, 0.456, 0.406],
+            dtype='float32')
+        std = np.array(
+            std if std is not None else [0.229, 0.224, 0.225],
+            dtype='float32')
+        if normalize:
+            self.alpha = scale / std
+            self.beta = -mean / std
+        else:
+            self.alpha = np.ones(3, dtype='float32')
+            self.beta = np.zeros(3, dtype='float32')
+
+    def alloc_batch(self, batch_size):
+        return np.empty(
+            (batch_size, 3, self.size, self.size), dtype='float32')
+
+    def resize_crop(self, img):
+        return self.crop_op(self.resize_op(img))
+
+    def normalize(self, img, out=None, bgr=False):
+        """
+        Args:
+            img(np.ndarray): HWC uint8 image
+            out(np.ndarray): CHW float32 output, allocated if None
+            bgr(bool): whether img is BGR, the output is always RGB
+        """
+        h, w, c = img.shape
+        if out is None:
+            out = np.empty((c, h, w), dtype='float32')
+        for i in range(c):
+            src = img[:, :, c - 1 - i] if bgr else img[:, :, i]
+            np.multiply(src, self.alpha[i], out=out[i])
+            out[i] += self.beta[i]
+        return out
+
+    def __call__(self, img, out=None, bgr=False, timer=None):
+        if timer is None:
+            return self.normalize(self.resize_crop(img), out, bgr)
+        with timer.stage("resize"):
+            img = self.resize_crop(img)
+        with timer.stage("normalize"):
+            return self.normalize(img, out, bgr)
+
+
+_preprocessors = {}
+
+
+def create_preprocessor(args):
+    key = (args.resize_short, args.resize, args.normalize)
+    if key not in _preprocessors:
+        _preprocessors[key] = Preprocessor(
+            resize_short=args.resize_short,
+            resize=args.resize,
+            normalize=args.normalize)
+    return _preprocessors[key]
 
 
-def postprocess(batch_outputs, topk=5, multilabel=False):
-    batch_results = []
-    for probs in batch_outputs:
-        results = []
-        if multilabel:
-            index = np.where(probs >= 0.5)[0].astype('int32')
-        else:
-            index = probs.argsort(axis=0)[-topk:][::-1].astype("int32")
-        clas_id_list = []
-        score_list = []
-        for i in index:
-            clas_id_list.append(i.item())
-            score_list.append(probs[i].item())
-        batch_results.append({"clas_ids": clas_id_list, "scores": score_list})
-    return batch_results
+def preprocess(img, args):
+    return create_preprocessor(args)(img)
+
+
+def imread(img_path, timer=None):
+    """
+    same as cv2.imread, reading and decoding are recorded as stages of
+    timer(ppcls.utils.profiler.StageTimer) if it is given
+    """
+    if timer is None:
+        return cv2.imread(img_path)
+    with timer.stage("read"):
+        try:
+            data = np.fromfile(img_path, dtype='uint8')
+        except (IOError, OSError):
+            return None
+    with timer.stage("decode"):
+        return cv2.imdecode(data, 1) if data.size > 0 else None
+
+
+def batch_topk(batch_outputs, topk=5, multilabel=False, threshold=0.5):
+    """
+    select classes of the whole batch at once
+
+    Args:
+        batch_outputs(np.ndarray): (N, C) scores
+        topk(int): number of classes kept for every sample
+        multilabel(bool): keep all classes whose score >= threshold instead
+
+    Returns:
+        class_ids(np.ndarray): (N, K) int32, sorted by score in descending
+            order, or by class id for multilabel; padded with -1
+        scores(np.ndarray): (N, K) scores of class_ids, padded with 0
+        lengths(np.ndarray): (N, ) number of valid classes of every sample
+    """
+    batch_outputs = batch_outputs.reshape(len(batch_outputs), -1)
+    num, class_num = batch_outputs.shape
+    if multilabel:
+        mask = batch_outputs >= threshold
+        lengths = mask.sum(axis=1)
+        k = int(lengths.max()) if num > 0 else 0
+        # stable sort moves the selected classes to the front in id order
+        class_ids = np.argsort(~mask, axis=1, kind='stable')[:, :k]
+        scores = np.take_along_axis(batch_outputs, class_ids, axis=1)
+        invalid = np.arange(k) >= lengths[:, None]
+        class_ids[invalid] = -1
+        scores[invalid] = 0
+    else:
+        k = min(topk, class_num)
+        class_ids = np.argpartition(-batch_outputs, k - 1, axis=1)[:, :k]
+        scores = np.take_along_axis(batch_outputs, class_ids, axis=1)
+        order = np.argsort(-scores, axis=1, kind='stable')
+        class_ids = np.take_along_axis(class_ids, order, axis=1)
+        scores = np.take_along_axis(scores, order, axis=1)
+        lengths = np.full(num, k)
+    return class_ids.astype('int32'), scores, lengths
 
 
-def get_image_list(img_file):
-    imgs_lists = []
+def postprocess(batch_outputs, topk=5, multilabel=False):
+    class_ids, scores, lengths = batch_topk(batch_outputs, topk, multilabel)
+    return [{
+        "clas_ids": ids[:length].tolist(),
+        "scores": score[:length].tolist()
+    } for ids, score, length in zip(class_ids, scores, lengths)]
+
+
+def iter_image_list(img_file):
+    """
+    yield the image paths of img_file lazily, so that directories with
+    millions of images are listed in constant memory
+    """
     if img_file is None or not os.path.exists(img_file):
         raise Exception("not found any img file in {}".format(img_file))
 
     img_end = ['jpg', 'png', 'jpeg', 'JPEG', 'JPG', 'bmp']
+    num = 0
     if os.path.isfile(img_file) and img_file.split('.')[-1] in img_end:
-        imgs_lists.append(img_file)
+        num += 1
+        yield img_file
     elif os.path.isdir(img_file):
-        for single_file in os.listdir(img_file):
-            if single_file.split('.')[-1] in img_end:
-                imgs_lists.append(os.path.join(img_file, single_file))
-    if len(imgs_lists) == 0:
+        for entry in os.scandir(img_file):
+            if entry.name.split('.')[-1] in img_end:
+                num += 1
+                yield os.path.join(img_file, entry.name)
+    if num == 0:
         raise Exception("not found any img file in {}".format(img_file))
-    return imgs_lists
+
+
+def get_image_list(img_file):
+    return list(iter_image_list(img_file))
 
 
 def save_prelabel_results(class_id, input_file_path, output_dir):
@@ -166,6 +336,119 @@ def save_prelabel_results(class_id, input_file_path, output_dir):
     shutil.copy(input_file_path, output_dir)
 
 
+class JsonlSink(object):
+    """
+    Write prediction results as json lines with buffered I/O
+
+    Args:
+        path(str): output file path
+        buffer_size(int): size of the write buffer in bytes
+    """
+
+    def __init__(self, path, buffer_size=1 << 20):
+        self.path = path
+        self._file = open(path, 'w', buffering=buffer_size)
+
+    def write(self, result):
+        record = {}
+        for key, value in result.items():
+            record[key] = value.tolist() if isinstance(value,
+                                                       np.ndarray) else value
+        self._file.write(json.dumps(record, ensure_ascii=False))
+        self._file.write('\n')
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class NpzSink(object):
+    """
+    Write prediction results as arrays in chunked npz files, every chunk
+    holds at most chunk_size results in "{stem}-{index:05d}.npz" with:
+        filenames: (N, ) str
+        class_ids: (N, K) int32, padded with -1
+        scores: (N, K) float32, padded with 0
+
+    Args:
+        path(str): output path, such as "output/result.npz"
+        chunk_size(int): max number of results of every chunk
+    """
+
+    def __init__(self, path, chunk_size=10000):
+        self.stem = path[:-len('.npz')] if path.endswith('.npz') else path
+        self.chunk_size = chunk_size
+        self.num_chunks = 0
+        self._filenames = []
+        self._class_ids = None
+        self._scores = None
+
+    def _alloc(self, topk):
+        self._class_ids = np.full(
+            (self.chunk_size, topk), -1, dtype='int32')
+        self._scores = np.zeros((self.chunk_size, topk), dtype='float32')
+
+    def write(self, result):
+        class_ids = np.asarray(result["class_ids"])
+        num = len(self._filenames)
+        if self._class_ids is None or len(class_ids) > \
+                self._class_ids.shape[1]:
+            old_class_ids, old_scores = self._class_ids, self._scores
+            self._alloc(len(class_ids))
+            if old_class_ids is not None:
+                topk = old_class_ids.shape[1]
+                self._class_ids[:num, :topk] = old_class_ids[:num]
+                self._scores[:num, :topk] = old_scores[:num]
+        self._class_ids[num, :len(class_ids)] = class_ids
+        self._scores[num, :len(class_ids)] = result["scores"]
+        self._filenames.append(result["filename"])
+        if len(self._filenames) == self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        num = len(self._filenames)
+        if num == 0:
+            return
+        path = "{}-{:05d}.npz".format(self.stem, self.num_chunks)
+        with open(path, 'wb') as fout:
+            np.savez(
+                fout,
+                filenames=np.array(self._filenames),
+                class_ids=self._class_ids[:num],
+                scores=self._scores[:num])
+        self.num_chunks += 1
+        self._filenames = []
+        self._class_ids[:num] = -1
+        self._scores[:num] = 0
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def create_sink(path):
+    """
+    create the result sink by the extension of path, .jsonl or .npz
+    """
+    if path.endswith('.jsonl') or path.endswith('.json'):
+        return JsonlSink(path)
+    if path.endswith('.npz'):
+        return NpzSink(path)
+    raise ValueError(
+        "unsupported output file {}, the extension should be .jsonl or .npz".
+        format(path))
+
+
 class ResizeImage(object):
     def __init__(self, resize_short=None):
         self.resize_short = resize_short
@@ -224,10 +507,102 @@ def b64_to_np(b64str, revert_params):
     dtype = revert_params["dtype"]
     dtype = getattr(np, dtype) if isinstance(str, type(dtype)) else dtype
     data = base64.b64decode(b64str.encode('utf8'))
-    data = np.fromstring(data, dtype).reshape(shape)
+    data = np.frombuffer(data, dtype).reshape(shape)
     return data
 
 
 def np_to_b64(images):
     img_str = base64.b64encode(images).decode('utf8')
     return img_str, images.shape
+
+
+# kinds of the frames in the binary wire format
+FRAME_ENCODED = 0
+FRAME_UINT8_HWC = 1
+_FRAME_HEADER = struct.Struct("<BIIII")  # kind, height, width, channel, size
+
+
+def pack_frames(images, kind=FRAME_ENCODED):
+    """
+    pack images into a length-prefixed binary body:
+        num         uint32, number of frames
+        frames      num x (kind uint8, h, w, c, size uint32, payload)
+
+    Args:
+        images(list): encoded image bytes (jpeg, png...) for FRAME_ENCODED,
+            or BGR uint8 HWC np.ndarray for FRAME_UINT8_HWC
+        kind(int): FRAME_ENCODED or FRAME_UINT8_HWC
+
+    Returns:
+        bytes
+    """
+    chunks = [struct.pack("<I", len(images))]
+    for img in images:
+        if kind == FRAME_UINT8_HWC:
+            img = np.ascontiguousarray(img, dtype='uint8')
+            h, w, c = img.shape
+            payload = img.data
+        else:
+            h, w, c = 0, 0, 0
+            payload = memoryview(img)
+        chunks.append(_FRAME_HEADER.pack(kind, h, w, c, payload.nbytes))
+        chunks.append(payload)
+    return b"".join(chunks)
+
+
+def unpack_frames(data):
+    """
+    unpack the body created by pack_frames, the frames are uint8 views of
+    data and are not copied
+
+    Returns:
+        list of np.ndarray: 1-D encoded bytes for FRAME_ENCODED, HWC image
+            for FRAME_UINT8_HWC
+    """
+    if len(data) < 4:
+        raise ValueError("truncated frames: {} bytes".format(len(data)))
+    num = struct.unpack_from("<I", data, 0)[0]
+    offset = 4
+    frames = []
+    for _ in range(num):
+        if offset + _FRAME_HEADER.size > len(data):
+            raise ValueError("truncated frame header at {}".format(offset))
+        kind, h, w, c, size = _FRAME_HEADER.unpack_from(data, offset)
+        offset += _FRAME_HEADER.size
+        if offset + size > len(data):
+            raise ValueError("truncated frame payload at {}".format(offset))
+        frame = np.frombuffer(data, dtype='uint8', count=size, offset=offset)
+        offset += size
+        if kind == FRAME_UINT8_HWC:
+            frame = frame.reshape((h, w, c))
+        elif kind != FRAME_ENCODED:
+            raise ValueError("unknown frame kind {}".format(kind))
+        frames.append(frame)
+    return frames
+
+
+def b64_to_frames(b64str):
+    return unpack_frames(base64.b64decode(b64str.encode('utf8')))
+
+
+def frames_to_b64(images, kind=FRAME_ENCODED):
+    return base64.b64encode(pack_frames(images, kind)).decode('utf8')
+
+
+def preprocess_frame(frame, preprocessor, out=None):
+    """
+    decode an unpacked frame if needed and preprocess it into out, uint8
+    HWC frames already of the output size skip resize and crop. Decoded
+    frames are always resized and cropped, as the images of the other
+    transports
+    """
+    if frame.ndim == 1:
+        img = cv2.imdecode(frame, 1)
+        if img is None:
+            raise ValueError("failed to decode the image frame")
+        img = preprocessor.resize_crop(img)
+    else:
+        img = frame
+        if img.shape[:2] != (preprocessor.size, preprocessor.size):
+            img = preprocessor.resize_crop(img)
+    return preprocessor.normalize(img, out, bgr=True)
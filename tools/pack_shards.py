@@ -0,0 +1,93 @@
+# copyright (c) 2020 PaddlePaddle Authors. All Rights Reserve.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Pack the images of a file list into shard files, e.g.
+
+    python tools/pack_shards.py \
+        --file_list ./dataset/ILSVRC2012/train_list.txt \
+        --data_dir ./dataset/ILSVRC2012/ \
+        --output_dir ./dataset/ILSVRC2012_shards/ \
+        --prefix train
+
+and then set `TRAIN.data_dir` to the output dir and `TRAIN.shard_list` to
+the generated `train_shard_list.txt`.
+"""
+
+import argparse
+import os
+import sys
+__dir__ = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(__dir__)
+sys.path.append(os.path.abspath(os.path.join(__dir__, '..')))
+
+from ppcls.data.shard import write_shard
+from ppcls.utils import logger
+
+
+def parse_args():
+    parser = argparse.ArgumentParser("PaddleClas shard packing script")
+    parser.add_argument('--file_list', type=str, required=True)
+    parser.add_argument('--data_dir', type=str, default='')
+    parser.add_argument('--output_dir', type=str, required=True)
+    parser.add_argument('--prefix', type=str, default='train')
+    parser.add_argument('--delimiter', type=str, default=' ')
+    parser.add_argument(
+        '--shard_size',
+        type=int,
+        default=1024,
+        help='approximate size of every shard in MB')
+
+    return parser.parse_args()
+
+
+def main(args):
+    with open(args.file_list) as flist:
+        lines = [line.strip() for line in flist if line.strip()]
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    max_bytes = args.shard_size * 1024 * 1024
+    shard_names = []
+    samples = []
+    shard_bytes = 0
+
+    def flush():
+        name = "{}-{:05d}.shard".format(args.prefix, len(shard_names))
+        write_shard(os.path.join(args.output_dir, name), samples)
+        shard_names.append(name)
+        logger.info("write {} with {} samples".format(name, len(samples)))
+
+    for line in lines:
+        img_path, label = line.split(args.delimiter)
+        img_path = os.path.join(args.data_dir, img_path)
+        samples.append((img_path, int(label)))
+        shard_bytes += os.path.getsize(img_path)
+        if shard_bytes >= max_bytes:
+            flush()
+            samples = []
+            shard_bytes = 0
+    if len(samples) > 0:
+        flush()
+
+    shard_list = os.path.join(args.output_dir,
+                              "{}_shard_list.txt".format(args.prefix))
+    with open(shard_list, 'w') as fout:
+        for name in shard_names:
+            fout.write(name + "\n")
+    logger.info("pack {} samples into {} shards, shard list: {}".format(
+        len(lines), len(shard_names), shard_list))
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    main(args)
@@ -29,12 +29,17 @@ import paddle.nn.functional as F
 from ppcls.optimizer import LearningRateBuilder
 from ppcls.optimizer import OptimizerBuilder
 from ppcls.modeling import architectures
+from ppcls.data.imaug import transform
+from ppcls.data.imaug.device_operators import create_device_operators
+from ppcls.data.imaug.device_operators import create_device_normalize
+from ppcls.data.imaug.transform_profiler import get_transform_profiler
 from ppcls.modeling.loss import MultiLabelLoss
 from ppcls.modeling.loss import CELoss
 from ppcls.modeling.loss import MixCELoss
 from ppcls.modeling.loss import JSDivLoss
 from ppcls.modeling.loss import GoogLeNetLoss
 from ppcls.utils.misc import AverageMeter
+from ppcls.utils.profiler import StepProfiler
 from ppcls.utils import logger
 from ppcls.utils import multi_hot_encode
 from ppcls.utils import hamming_distance
@@ -187,7 +192,7 @@ def create_metric(out,
     return fetchs
 
 
-def create_fetchs(feeds, net, config, mode="train"):
+def create_fetchs(feeds, net, config, mode="train", profiler=None):
     """
     Create fetchs as model outputs(included loss and measures),
     will call create_loss and create_metric(if use_mix).
@@ -202,10 +207,13 @@ def create_fetchs(feeds, net, config, mode="train"):
         classes_num(int): num of classes
         epsilon(float): parameter for label smoothing, 0.0 <= epsilon <= 1.0
         use_mix(bool): whether to use mix(include mixup, cutmix, fmix)
+        profiler(StepProfiler): records forward, loss and metric if given
 
     Returns:
         fetchs(dict): dict of model outputs(included loss and measures)
     """
+    if profiler is None:
+        profiler = _disabled_profiler
     architecture = config.ARCHITECTURE
     topk = config.topk
     classes_num = config.classes_num
@@ -214,22 +222,25 @@ def create_fetchs(feeds, net, config, mode="train"):
     use_distillation = config.get('use_distillation')
     multilabel = config.get('multilabel', False)
 
-    out = net(feeds["image"])
+    with profiler.stage("forward"):
+        out = net(feeds["image"])
 
     fetchs = OrderedDict()
-    fetchs['loss'] = create_loss(feeds, out, architecture, classes_num,
-                                 epsilon, use_mix, use_distillation,
-                                 multilabel)
+    with profiler.stage("loss"):
+        fetchs['loss'] = create_loss(feeds, out, architecture, classes_num,
+                                     epsilon, use_mix, use_distillation,
+                                     multilabel)
     if not use_mix:
-        metric = create_metric(
-            out,
-            feeds["label"],
-            architecture,
-            topk,
-            classes_num,
-            use_distillation,
-            multilabel=multilabel,
-            mode=mode)
+        with profiler.stage("metric"):
+            metric = create_metric(
+                out,
+                feeds["label"],
+                architecture,
+                topk,
+                classes_num,
+                use_distillation,
+                multilabel=multilabel,
+                mode=mode)
         fetchs.update(metric)
 
     return fetchs
@@ -273,8 +284,19 @@ def create_optimizer(config, parameter_list=None):
     return opt(lr, parameter_list), lr
 
 
-def create_feeds(batch, use_mix, num_classes, multilabel=False):
+def create_feeds(batch,
+                 use_mix,
+                 num_classes,
+                 multilabel=False,
+                 normalize=None):
+    """
+    Args:
+        normalize(DeviceNormalize): normalizes the uint8 images of the
+            reader with normalize_on_device, None if they are normalized
+    """
     image = batch[0]
+    if normalize is not None:
+        image = normalize(image)
     if use_mix:
         y_a = to_tensor(batch[1].numpy().astype("int64").reshape(-1, 1))
         y_b = to_tensor(batch[2].numpy().astype("int64").reshape(-1, 1))
@@ -290,7 +312,94 @@ def create_feeds(batch, use_mix, num_classes, multilabel=False):
     return feeds
 
 
+class DeviceMetricAccumulator(object):
+    """
+    Keep the running sums of the fetchs on device, and update the
+    AverageMeters with one device to host copy in sync, instead of one
+    blocking fetch.numpy() per metric per step. The meters end up with the
+    same sum, count and avg as updating them every step, and val is the
+    value of the last step.
+    """
+
+    def __init__(self):
+        self.names = None
+        self.sums = None
+        self.last = None
+        self.count = 0
+
+    def update(self, fetchs, batch_size):
+        if self.names is None:
+            self.names = list(fetchs.keys())
+        # detached, so that the sums do not keep the graphs of the steps
+        values = paddle.concat([
+            paddle.cast(
+                fetchs[name].detach(), 'float32').reshape([-1])[:1]
+            for name in self.names
+        ])
+        self.last = values
+        if self.sums is None:
+            self.sums = values * batch_size
+        else:
+            self.sums = self.sums + values * batch_size
+        self.count += batch_size
+
+    def sync(self, metric_list):
+        if self.sums is None:
+            return
+        num = len(self.names)
+        data = paddle.concat([self.sums, self.last]).numpy()
+        for idx, name in enumerate(self.names):
+            meter = metric_list[name]
+            meter.sum += data[idx]
+            meter.count += self.count
+            meter.avg = meter.sum / meter.count
+            meter.val = data[num + idx]
+        self.sums = None
+        self.count = 0
+
+
 total_step = 0
+_disabled_profiler = StepProfiler(enabled=False)
+# created by the first training run, so that steps count across epochs
+train_profiler = None
+
+
+def create_profiler(config):
+    """
+    Create the training step profiler from the PROFILER section, such as
+        PROFILER:
+            sync: True
+            trace_path: ./output/trace.json
+            trace_start: 10
+            trace_steps: 10
+    profiling is disabled if there is no PROFILER section
+    """
+    profiler_config = config.get("PROFILER")
+    if not profiler_config:
+        return _disabled_profiler
+    return StepProfiler(
+        sync=profiler_config.get("sync", True),
+        trace_path=profiler_config.get("trace_path"),
+        trace_start=profiler_config.get("trace_start", 10),
+        trace_steps=profiler_config.get("trace_steps", 10),
+        pid=paddle.distributed.get_rank())
+
+
+def close_profiler():
+    """
+    save the partial trace of the training profiler if training ended
+    before the end of its trace window
+    """
+    if train_profiler is None:
+        return
+    traced_steps = train_profiler.close()
+    if traced_steps is not None:
+        logger.warning(
+            "training ended at step {} before the end of the trace window "
+            "[{}, {}), saved {} traced steps to {}".format(
+                train_profiler.step, train_profiler.trace_start,
+                train_profiler.trace_end, traced_steps,
+                train_profiler.trace_path))
 
 
 def run(dataloader,
@@ -315,9 +424,18 @@ def run(dataloader,
     Returns:
     """
     print_interval = config.get("print_interval", 10)
+    # fetch the metrics from device every print_interval steps only
+    accumulator = DeviceMetricAccumulator() if config.get(
+        "accumulate_metrics", False) else None
     use_mix = config.get("use_mix", False) and mode == "train"
     multilabel = config.get("multilabel", False)
     classes_num = config.get("classes_num")
+    # the reader ships unmixed batches, mix them on device after the feed
+    device_mix_ops = []
+    if use_mix and config.get("mix_on_device", False):
+        device_mix_ops = create_device_operators(config['TRAIN']['mix'])
+    # the same decision as the reader of mode
+    normalize = create_device_normalize(config, mode)
 
     metric_list = [
         ("loss", AverageMeter(
@@ -348,7 +466,16 @@ def run(dataloader,
 
     metric_list = OrderedDict(metric_list)
 
+    global train_profiler
+    if mode == 'train':
+        if train_profiler is None:
+            train_profiler = create_profiler(config)
+        profiler = train_profiler
+    else:
+        profiler = _disabled_profiler
+
     tic = time.time()
+    reader_start = time.perf_counter()
     for idx, batch in enumerate(dataloader()):
         # avoid statistics from warmup time
         if idx == 10:
@@ -356,16 +483,27 @@ def run(dataloader,
             metric_list["reader_time"].reset()
 
         metric_list['reader_time'].update(time.time() - tic)
+        if profiler.enabled:
+            profiler.add("reader", reader_start, time.perf_counter())
         batch_size = len(batch[0])
-        feeds = create_feeds(batch, use_mix, classes_num, multilabel)
-        fetchs = create_fetchs(feeds, net, config, mode)
+        with profiler.stage("feed"):
+            feeds = create_feeds(batch, use_mix and not device_mix_ops,
+                                 classes_num, multilabel, normalize)
+        if device_mix_ops:
+            with profiler.stage("mix"):
+                feeds = transform(feeds, device_mix_ops)
+        fetchs = create_fetchs(feeds, net, config, mode, profiler)
         if mode == 'train':
             avg_loss = fetchs['loss']
-            avg_loss.backward()
-
-            optimizer.step()
-            optimizer.clear_grad()
-            lr_value = optimizer._global_learning_rate().numpy()[0]
+            with profiler.stage("backward"):
+                avg_loss.backward()
+
+            with profiler.stage("optimizer_step"):
+                optimizer.step()
+            with profiler.stage("clear_grad"):
+                optimizer.clear_grad()
+            # the learning rate is kept on host by the scheduler, no sync
+            lr_value = optimizer.get_lr()
             metric_list['lr'].update(lr_value, batch_size)
 
             if lr_scheduler is not None:
@@ -379,21 +517,37 @@ def run(dataloader,
                 else:
                     lr_scheduler.step()
 
-        for name, fetch in fetchs.items():
-            metric_list[name].update(fetch.numpy()[0], batch_size)
+        need_sync = accumulator is None or idx % print_interval == 0
+        if accumulator is not None:
+            with profiler.stage("metric_accumulate"):
+                accumulator.update(fetchs, batch_size)
+            if need_sync:
+                with profiler.stage("metric_sync"):
+                    accumulator.sync(metric_list)
+        else:
+            # every fetch.numpy() waits for the device
+            with profiler.stage("metric_sync"):
+                for name, fetch in fetchs.items():
+                    metric_list[name].update(fetch.numpy()[0], batch_size)
         metric_list["batch_time"].update(time.time() - tic)
+        profiler.next_step()
         tic = time.time()
+        reader_start = time.perf_counter()
 
         if vdl_writer and mode == "train":
             global total_step
-            logger.scaler(
-                name="lr", value=lr_value, step=total_step, writer=vdl_writer)
-            for name, fetch in fetchs.items():
+            if need_sync:
                 logger.scaler(
-                    name="train_{}".format(name),
-                    value=fetch.numpy()[0],
+                    name="lr",
+                    value=lr_value,
                     step=total_step,
                     writer=vdl_writer)
+                for name in fetchs:
+                    logger.scaler(
+                        name="train_{}".format(name),
+                        value=metric_list[name].val,
+                        step=total_step,
+                        writer=vdl_writer)
             total_step += 1
 
         fetchs_str = ' '.join([
@@ -419,6 +573,8 @@ def run(dataloader,
                 logger.info("{:s} step:{:<4d}, {:s} {:s}".format(
                     mode, idx, fetchs_str, ips_info))
 
+    if accumulator is not None:
+        accumulator.sync(metric_list)
     end_str = ' '.join([str(m.mean) for m in metric_list.values()] +
                        [metric_list['batch_time'].total])
     ips_info = "ips: {:.5f} images/sec.".format(
@@ -431,6 +587,16 @@ def run(dataloader,
         end_epoch_str = "END epoch:{:<3d}".format(epoch)
         logger.info("{:s} {:s} {:s} {:s}".format(end_epoch_str, mode, end_str,
                                                  ips_info))
+    if profiler.enabled:
+        logger.info("step time breakdown of {:s} epoch {:d}:\n{:s}".format(
+            mode, epoch, profiler.report()))
+    # the reader of eval.py is created in valid mode
+    transform_profiler = get_transform_profiler("train" if mode == "train"
+                                                else "valid")
+    if transform_profiler is not None:
+        logger.info("transform time of {:s} epoch {:d}:\n{:s}".format(
+            mode, epoch, transform_profiler.report()))
+        transform_profiler.reset()
 
     # return top1_acc in order to save the best model
     if mode == 'valid':
@@ -78,6 +78,14 @@ def main(args):
     assert (
         use_gpu and use_xpu
     ) is not True, "gpu and xpu can not be true in the same time in static mode!"
+    # the reader skips the batch operators, which only the dygraph
+    # program.run applies on device
+    assert not config.get("mix_on_device", False), \
+        "mix_on_device is not supported in static mode, please use tools/train.py"
+    # the reader ships uint8 images, which only the dygraph create_feeds
+    # normalizes on device
+    assert not config.get("normalize_on_device", False), \
+        "normalize_on_device is not supported in static mode, please use tools/train.py"
 
     if use_gpu:
         place = paddle.set_device('gpu')
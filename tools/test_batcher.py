@@ -0,0 +1,123 @@
+# Copyright (c) 2020 PaddlePaddle Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Check the dynamic batcher of hubserving with a stub predictor, without
+paddle or a model, e.g.
+
+    python tools/test_batcher.py
+"""
+
+import os
+import sys
+import threading
+import time
+__dir__ = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(__dir__)
+sys.path.append(os.path.abspath(os.path.join(__dir__, '..')))
+
+import numpy as np
+
+from deploy.hubserving.clas.batcher import DynamicBatcher
+
+
+class StubPredictor(object):
+    """
+    returns the first pixel of every image as its output, and records the
+    sizes of the batches
+    """
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.batch_sizes = []
+        self._lock = threading.Lock()
+
+    def __call__(self, inputs):
+        with self._lock:
+            self.batch_sizes.append(len(inputs))
+        time.sleep(self.delay)
+        return inputs[:, 0, 0, 0].copy()
+
+
+def make_inputs(request_id, num):
+    """ images whose first pixel identifies the request and the image """
+    inputs = np.zeros((num, 3, 4, 4), dtype='float32')
+    inputs[:, 0, 0, 0] = request_id * 100 + np.arange(num)
+    return inputs
+
+
+def check_result(future, request_id, num, timeout=10):
+    outputs = future.result(timeout)
+    expected = request_id * 100 + np.arange(num)
+    assert (outputs == expected).all(), \
+        "request {} got {}, expect {}".format(request_id, outputs, expected)
+
+
+def check_scatter_order():
+    """ outputs of coalesced requests go back to their own requests """
+    predictor = StubPredictor()
+    batcher = DynamicBatcher(
+        predictor, max_batch_size=8, max_wait_ms=50, num_threads=2)
+    sizes = [1, 3, 2, 1, 4, 2, 1, 3, 2, 1]
+    futures = [
+        batcher.submit(make_inputs(idx, num)) for idx, num in enumerate(sizes)
+    ]
+    for idx, (future, num) in enumerate(zip(futures, sizes)):
+        check_result(future, idx, num)
+    batcher.close()
+    assert len(predictor.batch_sizes) < len(sizes), \
+        "requests are not coalesced: {}".format(predictor.batch_sizes)
+    assert max(predictor.batch_sizes) <= 8
+    assert sum(predictor.batch_sizes) == sum(sizes)
+
+
+def check_large_request():
+    """ a request larger than max_batch_size is run alone """
+    predictor = StubPredictor()
+    batcher = DynamicBatcher(predictor, max_batch_size=4, max_wait_ms=50)
+    small = batcher.submit(make_inputs(0, 1))
+    large = batcher.submit(make_inputs(1, 10))
+    after = batcher.submit(make_inputs(2, 2))
+    check_result(small, 0, 1)
+    check_result(large, 1, 10)
+    check_result(after, 2, 2)
+    batcher.close()
+    assert predictor.batch_sizes == [1, 10, 2], \
+        "batches: {}".format(predictor.batch_sizes)
+
+
+def check_close_pending():
+    """ close() runs the requests queued before it """
+    predictor = StubPredictor(delay=0.02)
+    batcher = DynamicBatcher(
+        predictor, max_batch_size=4, max_wait_ms=10, num_threads=2)
+    sizes = [3, 2, 4, 1, 3, 2, 1, 4]
+    futures = [
+        batcher.submit(make_inputs(idx, num)) for idx, num in enumerate(sizes)
+    ]
+    batcher.close()
+    for idx, (future, num) in enumerate(zip(futures, sizes)):
+        assert future.done(), "request {} is not run by close()".format(idx)
+        check_result(future, idx, num, timeout=0)
+    assert sum(predictor.batch_sizes) == sum(sizes)
+
+
+def main():
+    check_scatter_order()
+    check_large_request()
+    check_close_pending()
+    print("dynamic batcher check passed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+# Copyright (c) 2020 PaddlePaddle Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Check that the device batch operators of mix_on_device mix a batch as the
+batch operators of the reader with the same seed, on the cpu place, e.g.
+
+    python tools/test_device_operators.py
+"""
+
+import os
+import random
+import sys
+__dir__ = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(__dir__)
+sys.path.append(os.path.abspath(os.path.join(__dir__, '..')))
+
+import numpy as np
+import paddle
+
+from ppcls.data.imaug.batch_operators import MixupOperator
+from ppcls.data.imaug.batch_operators import CutmixOperator
+from ppcls.data.imaug.batch_operators import FmixOperator
+from ppcls.data.imaug.device_operators import DeviceMixupOperator
+from ppcls.data.imaug.device_operators import DeviceCutmixOperator
+from ppcls.data.imaug.device_operators import DeviceFmixOperator
+
+OPERATORS = [
+    (MixupOperator, DeviceMixupOperator, {
+        "alpha": 0.2
+    }),
+    (CutmixOperator, DeviceCutmixOperator, {
+        "alpha": 0.2
+    }),
+    (FmixOperator, DeviceFmixOperator, {
+        "alpha": 1
+    }),
+]
+
+
+def seed_all(seed):
+    np.random.seed(seed)
+    random.seed(seed)
+
+
+def check(batch_op, device_op, seed, batch_size=8, size=32):
+    rng = np.random.RandomState(seed)
+    imgs = rng.rand(batch_size, 3, size, size).astype('float32')
+    labels = rng.randint(0, 1000, batch_size).astype('int64')
+
+    seed_all(seed)
+    outputs = batch_op((imgs.copy(), labels))
+    # the layout of the reader batches, see Reader.mix_collate_fn
+    assert len(outputs) == 4, "batch operators return 4 fields"
+    mixed, y_a, y_b, lams = outputs
+    assert mixed.shape == imgs.shape and mixed.dtype == imgs.dtype
+    assert y_a.shape == (batch_size, ) and y_b.shape == (batch_size, )
+    assert lams.shape == (batch_size, ) and lams.dtype == np.float32
+    assert (y_a == labels).all()
+
+    seed_all(seed)
+    feeds = device_op({
+        "image": paddle.to_tensor(imgs),
+        "label": paddle.to_tensor(labels.reshape(-1, 1))
+    })
+    name = type(device_op).__name__
+    assert np.allclose(feeds["image"].numpy(), mixed, atol=1e-5), \
+        "{}: the images differ".format(name)
+    assert (feeds["y_a"].numpy().reshape(-1) == y_a).all(), \
+        "{}: y_a differs".format(name)
+    assert (feeds["y_b"].numpy().reshape(-1) == y_b).all(), \
+        "{}: y_b differs".format(name)
+    assert np.allclose(feeds["lam"].numpy().reshape(-1), lams), \
+        "{}: lam differs".format(name)
+
+
+def main():
+    paddle.set_device('cpu')
+    for batch_cls, device_cls, params in OPERATORS:
+        for seed in range(5):
+            check(batch_cls(**params), device_cls(**params), seed)
+    print("device operators check passed")
+
+
+if __name__ == "__main__":
+    main()
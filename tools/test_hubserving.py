@@ -18,7 +18,8 @@ __dir__ = os.path.dirname(os.path.abspath(__file__))
 sys.path.append(__dir__)
 sys.path.append(os.path.abspath(os.path.join(__dir__, '..')))
 
-from tools.infer.utils import parse_args, get_image_list, preprocess, np_to_b64
+from tools.infer.utils import parse_args, get_image_list, create_preprocessor, np_to_b64
+from tools.infer.utils import frames_to_b64, FRAME_ENCODED, FRAME_UINT8_HWC
 from ppcls.utils import logger
 import numpy as np
 import cv2
@@ -28,9 +29,45 @@ import json
 import base64
 
 
+def load_image(img_path, args, preprocessor):
+    """
+    load the input of an image in the format of args.hubserving_format
+    """
+    if args.hubserving_format == "jpeg":
+        with open(img_path, 'rb') as fin:
+            return fin.read()
+    img = cv2.imread(img_path)
+    if img is None:
+        return None
+    if args.hubserving_format == "uint8":
+        return preprocessor.resize_crop(img)
+    return preprocessor(img, bgr=True)
+
+
+def create_request(batch_input_list, args):
+    if args.hubserving_format == "tensor":
+        batch_input = np.array(batch_input_list)
+        b64str, revert_shape = np_to_b64(batch_input)
+        return {
+            "images": b64str,
+            "revert_params": {
+                "shape": revert_shape,
+                "dtype": str(batch_input.dtype)
+            },
+            "top_k": args.top_k
+        }
+    kind = FRAME_ENCODED if args.hubserving_format == "jpeg" else FRAME_UINT8_HWC
+    return {
+        "images": frames_to_b64(batch_input_list, kind),
+        "input_format": "frames",
+        "top_k": args.top_k
+    }
+
+
 def main(args):
     image_path_list = get_image_list(args.image_file)
     headers = {"Content-type": "application/json"}
+    preprocessor = create_preprocessor(args)
 
     cnt = 0
     predict_time = 0
@@ -39,38 +76,26 @@ def main(args):
 
     batch_input_list = []
     img_name_list = []
-    cnt = 0
     for idx, img_path in enumerate(image_path_list):
-        img = cv2.imread(img_path)
-        if img is None:
+        data = load_image(img_path, args, preprocessor)
+        if data is None:
             logger.warning(
                 "Image file failed to read and has been skipped. The path: {}".
                 format(img_path))
-            continue
         else:
-            img = img[:, :, ::-1]
-            data = preprocess(img, args)
             batch_input_list.append(data)
             img_name = img_path.split('/')[-1]
             img_name_list.append(img_name)
-            cnt += 1
-        if cnt % args.batch_size == 0 or (idx + 1) == len(image_path_list):
-            batch_input = np.array(batch_input_list)
-            b64str, revert_shape = np_to_b64(batch_input)
-            data = {
-                "images": b64str,
-                "revert_params": {
-                    "shape": revert_shape,
-                    "dtype": str(batch_input.dtype)
-                },
-                "top_k": args.top_k
-            }
+        if len(batch_input_list) == args.batch_size or (
+                idx + 1 == len(image_path_list) and
+                len(batch_input_list) > 0):
+            data = create_request(batch_input_list, args)
             try:
                 r = requests.post(
                     url=args.server_url,
                     headers=headers,
                     data=json.dumps(data))
-                r.raise_for_status
+                r.raise_for_status()
                 if r.json()["status"] != "000":
                     msg = r.json()["msg"]
                     raise Exception(msg)
@@ -86,11 +111,12 @@ def main(args):
                 cnt += len(batch_result_list)
                 predict_time += elapse
 
-                for number, result_list in enumerate(batch_result_list):
-                    all_score += result_list[0]["score"]
+                for number, result_dict in enumerate(batch_result_list):
+                    all_score += result_dict["scores"][0]
                     result_str = ", ".join([
-                        "{}: {:.2f}".format(r["cls_id"], r["score"])
-                        for r in result_list
+                        "{}: {:.2f}".format(clas_id, score)
+                        for clas_id, score in zip(result_dict["clas_ids"],
+                                                  result_dict["scores"])
                     ])
                     logger.info("File:{}, The top-{} result(s): {}".format(
                         img_name_list[number], args.top_k, result_str))
@@ -0,0 +1,86 @@
+# Copyright (c) 2020 PaddlePaddle Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Check that a streaming worker yields exactly its quota of samples when
+records fail to decode, including the first one, e.g.
+
+    python tools/test_shard_stream.py
+"""
+
+import os
+import sys
+import tempfile
+__dir__ = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(__dir__)
+sys.path.append(os.path.abspath(os.path.join(__dir__, '..')))
+
+import cv2
+import numpy as np
+
+from ppcls.data.reader import ShardStreamDataset
+from ppcls.data.shard import write_shard
+
+
+def write_images(dirname, num, corrupt_ids):
+    """ jpeg files of random images, the ones of corrupt_ids are garbage """
+    rng = np.random.RandomState(0)
+    samples = []
+    for idx in range(num):
+        path = os.path.join(dirname, "{}.jpg".format(idx))
+        if idx in corrupt_ids:
+            data = rng.randint(0, 256, 64).astype('uint8').tobytes()
+        else:
+            img = rng.randint(0, 256, (32, 32, 3)).astype('uint8')
+            data = cv2.imencode('.jpg', img)[1].tobytes()
+        with open(path, 'wb') as fout:
+            fout.write(data)
+        samples.append((path, idx))
+    return samples
+
+
+def check(mode, corrupt_ids, num=10, batch_size=4):
+    with tempfile.TemporaryDirectory() as dirname:
+        samples = write_images(dirname, num, corrupt_ids)
+        write_shard(os.path.join(dirname, "0.shard"), samples)
+        shard_list = os.path.join(dirname, "shard_list.txt")
+        with open(shard_list, 'w') as fout:
+            fout.write("0.shard\n")
+        params = {
+            "mode": mode,
+            "data_dir": dirname,
+            "shard_list": shard_list,
+            "transforms": [{
+                "DecodeImage": {
+                    "to_rgb": True
+                }
+            }],
+        }
+        dataset = ShardStreamDataset(params, batch_size)
+        quota = dataset._assign(1)[0][1]
+        outputs = list(dataset)
+        assert len(outputs) == quota, \
+            "{} mode with corrupt records {}: {} samples, expect {}".format(
+                mode, sorted(corrupt_ids), len(outputs), quota)
+        assert all(img.shape == (32, 32, 3) for img, _ in outputs)
+
+
+def main():
+    for mode in ["train", "valid"]:
+        for corrupt_ids in [set(), {0}, {0, 1, 2}, {3, 9}]:
+            check(mode, corrupt_ids)
+    print("streaming quota check passed")
+
+
+if __name__ == "__main__":
+    main()
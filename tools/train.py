@@ -124,6 +124,7 @@ def main(args):
     except Exception as e:
         logger.error(e)
     finally:
+        program.close_profiler()
         vdl_writer.close() if vdl_writer else None
 
 